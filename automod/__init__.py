@@ -3,4 +3,5 @@ from .automod import AutoMod
 
 async def setup(bot):
     cog = AutoMod(bot)
+    await cog.initialize()
     bot.add_cog(cog)
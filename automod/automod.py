@@ -1,21 +1,37 @@
 import asyncio
 import logging
+import os
 import re
-from collections import defaultdict
-from typing import Union
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Iterable, List, Optional, Tuple, Union
 
 import discord
 from redbot.core import Config, commands
 from redbot.core.bot import Red
 from redbot.core.commands import Context
 from redbot.core.i18n import Translator, cog_i18n
+from redbot.core.utils.chat_formatting import box, pagify
 from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
-from redbot.core.utils.mod import is_mod_or_superior
 # from redbot.core.modlog import Case, create_case, get_modlog_channel,
 
 from .errors import LogNotSet
 from .events import Event
-from .utils import is_log_set
+from .executor import ActionExecutor
+from .invites import GuildInviteIndex, InviteCache
+from .logqueue import LogDispatcher
+from .keywords import is_literal
+from .matcher import FilterMatch, FilterMatcher, probe_pattern, probe_patterns
+from .rules import RuleContext, compile_rules, is_rule_enabled
+from .scanpool import ScanPool, ScanPoolError, ScanTimeout
+from .shadow import ShadowEntry, ShadowLog
+from .stats import (
+    GuildStats, StageTimer, format_counter, format_stages, format_us
+)
+from .tracker import DuplicateTracker, SpamTracker, fingerprint
+from .utils import ROLE_SETTING_COMMANDS, ModRoleCache, is_log_set
 
 log = logging.getLogger("red.automod")
 
@@ -40,6 +56,12 @@ default_guild = {
         'mute': False,
         'colour': None
     },
+    'duplicate_spam': {
+        'enabled': False,
+        'limit': 0,
+        'mute': False,
+        'colour': None
+    },
     'filter_invites': {
         'enabled': False,
         'whitelist': [],
@@ -48,17 +70,28 @@ default_guild = {
     'filter_messages': {
         'enabled': False,
         'filter': [],
+        # patterns too slow to search, see `FilterMatcher`
+        'quarantine': [],
+        # regex patterns which passed `probe_patterns`
+        'probed': [],
         'colour': None
     },
     'ignored': {
         'roles': [],
         'channels': [],
         'members': []
-    }
+    },
+    # events whose rules are evaluated without acting on them
+    'shadow': []
 }
 
 default_member = {}
 
+default_global = {
+    # worker processes searching large filters, 0 to search in the loop
+    'scan_processes': 0
+}
+
 _ = Translator("AutoMod", __file__)
 
 check_mark = "\N{WHITE HEAVY CHECK MARK}"
@@ -67,6 +100,15 @@ invite_regex = re.compile(
     r"\/|app\.com\/invite\/)([0-z]+))"
 )
 
+IgnoreIndex = namedtuple('IgnoreIndex', 'roles channels members')
+
+ActionPlan = namedtuple(
+    'ActionPlan', 'event message settings msg_refs mute invite match'
+)
+
+# discord refuses to bulk delete messages older than 14 days
+bulk_delete_max_age = timedelta(days=14, minutes=-5)
+
 __version__ = '1.0.1'
 
 
@@ -76,18 +118,230 @@ class AutoMod(commands.Cog):
 
     def __init__(self, bot: Red):
         self.bot = bot
-        self.messages = defaultdict(list)
-        self.attachments = defaultdict(list)
+        self.messages = SpamTracker()
+        self.attachments = SpamTracker()
+        self.duplicates = DuplicateTracker()
+
+        # guild id -> snapshot of guild settings, read by the listeners
+        self.settings_cache = {}
+        # guild id -> compiled message filter
+        self.filter_matchers = {}
+        # guild id -> IgnoreIndex of ignored role, channel and member ids
+        self.ignore_index = {}
+        # guild id -> enabled rules, cheapest first
+        self.rule_plans = {}
+        self.invites = InviteCache(self.bot.fetch_invite)
+        self.invite_index = GuildInviteIndex()
+        self.mod_roles = ModRoleCache(self.bot)
+        self.log_dispatcher = LogDispatcher()
+        self.executor = ActionExecutor()
+        self.shadow_log = ShadowLog()
+        self.scan_pool: Optional[ScanPool] = None
+        # regex patterns which passed `probe_patterns`
+        self.probed_patterns = set()
+        # guild id -> task probing new patterns of its filter
+        self.probe_tasks = {}
+        self.probe_slots = asyncio.Semaphore(2)
+        # guild id -> task looking for the pattern of a timed out search
+        self.slow_pattern_tasks = {}
+        # guild id -> GuildStats of on_message
+        self.stats = defaultdict(GuildStats)
 
         self.config = Config.get_conf(
             self, 1_330_157_707, force_registration=True
         )
 
+        self.config.register_global(**default_global)
         self.config.register_guild(**default_guild)
         self.config.register_member(**default_member)
 
         self.mute = self.bot.get_command("mute")
 
+    async def initialize(self):
+        """Start the scan pool and warm the settings cache."""
+
+        processes = await self.config.scan_processes()
+        if processes:
+            await self.start_scan_pool(processes)
+
+        all_guilds = await self.config.all_guilds()
+        # so guilds sharing a pattern don't wait for each other's probes
+        for settings in all_guilds.values():
+            self.probed_patterns.update(settings['filter_messages']['probed'])
+        for guild_id, settings in all_guilds.items():
+            self.cache_settings(guild_id, settings)
+
+    async def get_guild_settings(self, guild: discord.Guild) -> dict:
+        """Return cached settings of the guild, loading them on a miss."""
+
+        try:
+            return self.settings_cache[guild.id]
+        except KeyError:
+            return await self.refresh_settings(guild)
+
+    async def refresh_settings(self, guild: discord.Guild) -> dict:
+        """Reload settings of the guild into the settings cache.
+
+        Must be called by every command that writes guild settings.
+        """
+
+        settings = await self.config.guild(guild).all()
+        self.cache_settings(guild.id, settings)
+        return settings
+
+    def cache_settings(self, guild_id: int, settings: dict):
+        """Store settings snapshot and rebuild state derived from it."""
+
+        self.settings_cache[guild_id] = settings
+
+        ignored = settings['ignored']
+        self.ignore_index[guild_id] = IgnoreIndex(
+            roles=frozenset(ignored['roles']),
+            channels=frozenset(ignored['channels']),
+            members=frozenset(ignored['members'])
+        )
+
+        patterns = settings['filter_messages']['filter']
+        quarantined = settings['filter_messages']['quarantine']
+        # patterns are searched once they pass a probe
+        self.probed_patterns.update(settings['filter_messages']['probed'])
+        pending = self.unprobed_patterns(settings)
+        try:
+            self.filter_matchers[guild_id].update(
+                patterns, quarantined, pending
+            )
+        except KeyError:
+            self.filter_matchers[guild_id] = FilterMatcher(
+                patterns,
+                quarantined,
+                pending,
+                on_quarantine=partial(self.on_pattern_quarantine, guild_id)
+            )
+        if pending:
+            self.probe_filter(guild_id)
+
+        pooled = False
+        if self.scan_pool is not None:
+            self.scan_pool.update(
+                guild_id, patterns, [*quarantined, *pending]
+            )
+            pooled = self.scan_pool.has_guild(guild_id)
+
+        self.rule_plans[guild_id] = self.compile_rule_plan(settings, pooled)
+
+    def unprobed_patterns(self, settings: dict) -> List[str]:
+        """Return regex patterns of the filter which weren't probed yet."""
+
+        quarantined = settings['filter_messages']['quarantine']
+        return [
+            p for p in settings['filter_messages']['filter']
+            if p not in self.probed_patterns and p not in quarantined
+            and not is_literal(p)
+        ]
+
+    def probe_filter(self, guild_id: int):
+        """Probe new patterns of the guild's filter in the background."""
+
+        task = self.probe_tasks.get(guild_id)
+        if task is None or task.done():
+            self.probe_tasks[guild_id] = asyncio.get_event_loop().create_task(
+                self._probe_filter(guild_id)
+            )
+
+    async def _probe_filter(self, guild_id: int):
+        slow = set()
+        while True:
+            async with self.probe_slots:
+                settings = self.settings_cache.get(guild_id)
+                if settings is None:
+                    return
+                # other guilds may have probed the same patterns meanwhile
+                pending = [
+                    p for p in self.unprobed_patterns(settings)
+                    if p not in slow
+                ]
+                if not pending:
+                    break
+                found = await probe_patterns(pending)
+            slow.update(found)
+            self.probed_patterns.update(p for p in pending if p not in slow)
+            for pattern in found:
+                await self.quarantine_pattern(guild_id, pattern, None)
+
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+
+        # saved so the patterns are searched right away after a reload
+        async with self.config.guild(guild).filter_messages() as f:
+            self.save_probed(
+                f, [p for p in f['filter'] if p in self.probed_patterns]
+            )
+
+        # search the patterns which passed
+        await self.refresh_settings(guild)
+
+    def find_slow_patterns(self, guild_id: int, content: str):
+        """Quarantine patterns too slow on `content` in the background.
+
+        Called when the scan pool timed out searching `content`. Messages
+        which time out while patterns are searched for are skipped.
+        """
+
+        task = self.slow_pattern_tasks.get(guild_id)
+        if task is None or task.done():
+            self.slow_pattern_tasks[guild_id] = (
+                asyncio.get_event_loop().create_task(
+                    self._find_slow_patterns(guild_id, content)
+                )
+            )
+
+    async def _find_slow_patterns(self, guild_id: int, content: str):
+        settings = self.settings_cache.get(guild_id)
+        matcher = self.filter_matchers.get(guild_id)
+        if settings is None or matcher is None or self.scan_pool is None:
+            return
+
+        timeout = self.scan_pool.timeout
+        quarantined = settings['filter_messages']['quarantine']
+        # patterns searched in the pool, keywords can't be slow
+        patterns = [
+            p for p in dict.fromkeys(settings['filter_messages']['filter'])
+            if p not in quarantined and p not in matcher.pending
+            and not is_literal(p)
+        ]
+        async with self.probe_slots:
+            slow = await probe_patterns(patterns, timeout, text=content)
+
+        if not slow:
+            log.warning(
+                f"No single filter pattern of guild {guild_id} took over"
+                f" {timeout}s on a message which timed out."
+            )
+        for pattern in slow:
+            await self.quarantine_pattern(guild_id, pattern, timeout)
+
+    async def start_scan_pool(self, processes: int):
+        """Replace the scan pool with one of `processes` workers.
+
+        No pool is started if `processes` is 0. Rule plans of all guilds
+        are rebuilt to search their filters in the new pool.
+        """
+
+        if self.scan_pool is not None:
+            self.scan_pool.close()
+            self.scan_pool = None
+
+        if processes:
+            pool = ScanPool(
+                processes, on_quarantine=self.on_pattern_quarantine
+            )
+            await pool.start()
+            self.scan_pool = pool
+
+        for guild_id, settings in self.settings_cache.items():
+            self.cache_settings(guild_id, settings)
+
     @commands.group(name='automod')
     @commands.guild_only()
     @commands.admin_or_permissions()
@@ -108,6 +362,7 @@ class AutoMod(commands.Cog):
         `mention_spam`
         `message_spam`
         `attachment_spam`
+        `duplicate_spam`
         `filter_invites`
         `filter_messages`
         """
@@ -129,6 +384,8 @@ class AutoMod(commands.Cog):
             )
             changes += f"\n`{event.name}`: `{new}`"
 
+        await self.refresh_settings(guild)
+
         if changes:
             changes = _("Updated the following:\n{}").format(changes)
         else:
@@ -147,6 +404,7 @@ class AutoMod(commands.Cog):
         `mention_spam`
         `message_spam`
         `attachment_spam`
+        `duplicate_spam`
         """
 
         guild = ctx.guild
@@ -155,13 +413,25 @@ class AutoMod(commands.Cog):
             return await ctx.send("Invalid events!")
 
         changes = ""
+        # the tracker keeps `maxlen` earlier messages per member, and a
+        # limit of 1 would trip on every message
+        max_duplicates = self.duplicates.maxlen + 1
 
         for event in events:
+            if event.name == 'duplicate_spam' and not (
+                2 <= limit <= max_duplicates
+            ):
+                changes += _(
+                    "\n`{}`: not changed, the limit must be from 2 to `{}`"
+                ).format(event.name, max_duplicates)
+                continue
             await self.config.guild(guild).set_raw(
                 event.name, 'limit', value=limit
             )
             changes += f"\n`{event.name}`: `{limit}`"
 
+        await self.refresh_settings(guild)
+
         if changes:
             changes = _(
                 "Updated limit of the following:\n{}"
@@ -177,6 +447,7 @@ class AutoMod(commands.Cog):
         """Set duration, in seconds, for automod events."""
 
         await self.config.guild(ctx.guild).automod_duration.set(duration)
+        await self.refresh_settings(ctx.guild)
 
         await ctx.send(
             _("Set automod duration to {} seconds.").format(duration)
@@ -189,6 +460,7 @@ class AutoMod(commands.Cog):
         """Set channel for logging automod events."""
 
         await self.config.guild(ctx.guild).log_channel.set(channel.id)
+        await self.refresh_settings(ctx.guild)
 
         await ctx.send(
             _("Set {} as automod log channel.").format(channel.mention)
@@ -205,6 +477,7 @@ class AutoMod(commands.Cog):
         `mention_spam`
         `message_spam`
         `attachment_spam`
+        `duplicate_spam`
         """
 
         guild = ctx.guild
@@ -220,6 +493,8 @@ class AutoMod(commands.Cog):
             )
             changes += f"\n`{event.name}`: `{setting}`"
 
+        await self.refresh_settings(guild)
+
         if changes:
             changes = _(
                 "Updated mute of the following:\n{}"
@@ -243,12 +518,16 @@ class AutoMod(commands.Cog):
 
         async with self.config.guild(ctx.guild).ignored() as ignored:
             if isinstance(obj, discord.Role):
-                ignored['roles'].append(obj.id)
+                group = ignored['roles']
             elif isinstance(obj, discord.Member):
-                ignored['members'].append(obj.id)
-            elif isinstance(obj, discord.TextChannel):
-                ignored['channels'].append(obj.id)
+                group = ignored['members']
+            else:
+                group = ignored['channels']
 
+            if obj.id not in group:
+                group.append(obj.id)
+
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
     @_automod.command(name='unignore')
@@ -280,6 +559,7 @@ class AutoMod(commands.Cog):
                 except ValueError:
                     pass
 
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
     @_automod.command(name='colour', aliases=['color'])
@@ -294,6 +574,7 @@ class AutoMod(commands.Cog):
         `mention_spam`
         `message_spam`
         `attachment_spam`
+        `duplicate_spam`
         `filter_invites`
         `filter_messages`
         """
@@ -314,6 +595,8 @@ class AutoMod(commands.Cog):
             )
             changes += f"\n`{event.name}`: `{colour}`"
 
+        await self.refresh_settings(guild)
+
         if changes:
             changes = _("Updated the following:\n{}").format(changes)
         else:
@@ -333,9 +616,22 @@ class AutoMod(commands.Cog):
     async def _filter_add(self, ctx: Context, *, regex: str):
         """Add regex to the automod filter."""
 
+        try:
+            re.compile(regex)
+        except re.error as e:
+            return await ctx.send(_("Invalid regex: {}").format(e))
+
+        if not await probe_pattern(regex):
+            return await ctx.send(_(
+                "This regex is too slow on some messages, please simplify it."
+            ))
+        self.probed_patterns.add(regex)
+
         async with self.config.guild(ctx.guild).filter_messages() as f:
             f['filter'].append(regex)
+            self.save_probed(f, [regex])
 
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
     @_filter.command(name='view')
@@ -381,28 +677,195 @@ class AutoMod(commands.Cog):
 
         async with self.config.guild(ctx.guild).filter_messages() as f:
             try:
-                f['filter'].pop(number-1)
+                old = f['filter'].pop(number-1)
             except IndexError:
                 return await ctx.send(
                     _("Regex number {} doesn't exist in filter.").format(number)
                 )
+            self.unquarantine(f, old)
+            self.save_probed(f)
 
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
     @_filter.command(name='update')
     async def _filter_update(self, ctx: Context,number: int, *, regex: str):
         """Edit regex of the specified filter."""
 
+        try:
+            re.compile(regex)
+        except re.error as e:
+            return await ctx.send(_("Invalid regex: {}").format(e))
+
+        if not await probe_pattern(regex):
+            return await ctx.send(_(
+                "This regex is too slow on some messages, please simplify it."
+            ))
+        self.probed_patterns.add(regex)
+
         async with self.config.guild(ctx.guild).filter_messages() as f:
             try:
+                old = f['filter'][number-1]
                 f['filter'][number-1] = regex
             except IndexError:
                 return await ctx.send(
                     _("Regex number {} doesn't exist in filter.").format(number)
                 )
+            self.unquarantine(f, old)
+            self.save_probed(f, [regex])
+
+        await self.refresh_settings(ctx.guild)
+        await ctx.message.add_reaction(check_mark)
+
+    @_filter.command(name='profile')
+    async def _filter_profile(self, ctx: Context, count: int = 10):
+        """List filter patterns which take the most time to search."""
+
+        matcher = self.filter_matchers.get(ctx.guild.id)
+        if not matcher or not matcher.patterns:
+            return await ctx.send(_("Empty filter!"))
+
+        lines = [
+            f"{'#':>4}{'Samples':>10}{'Mean':>9}{'Max':>9}{'Total':>9}"
+            "  Pattern"
+        ]
+        numbers = {p: num for num, p in enumerate(matcher.patterns, start=1)}
+        for pattern, stats in matcher.profile(count):
+            lines.append(
+                f"{numbers[pattern]:>4}{stats.count:>10}"
+                f"{format_us(stats.mean * 1_000_000):>9}"
+                f"{format_us(stats.max * 1_000_000):>9}"
+                f"{format_us(stats.total * 1_000_000):>9}  {pattern[:40]}"
+            )
+
+        if matcher.keywords:
+            lines.append(_(
+                "\n{} plain word patterns are searched in one pass."
+            ).format(len(matcher.keywords)))
+
+        if matcher.pending:
+            lines.append(_(
+                "\n{} new patterns are tested before they're searched."
+            ).format(len(matcher.pending)))
+
+        if matcher.quarantined:
+            lines.append(_("\nQuarantined patterns:"))
+            for pattern, cost in matcher.quarantined.items():
+                took = format_us(cost * 1_000_000) if cost else "?"
+                lines.append(
+                    f"{numbers[pattern]:>4}  {pattern[:60]} ({took})"
+                )
+            lines.append(
+                _("Use `{}filter release <number>` to search one again.")
+                .format(ctx.clean_prefix)
+            )
+
+        for page in pagify("\n".join(lines), page_length=1900):
+            await ctx.send(box(page))
+
+    @_filter.command(name='release')
+    async def _filter_release(self, ctx: Context, number: int):
+        """Search a quarantined filter pattern again."""
+
+        async with self.config.guild(ctx.guild).filter_messages() as f:
+            try:
+                pattern = f['filter'][number-1]
+            except IndexError:
+                return await ctx.send(
+                    _("Regex number {} doesn't exist in filter.").format(number)
+                )
+            if not self.unquarantine(f, pattern):
+                return await ctx.send(
+                    _("Regex number {} isn't quarantined.").format(number)
+                )
+            # released patterns aren't probed again
+            self.save_probed(f, [pattern])
 
+        self.probed_patterns.add(pattern)
+        self.filter_matchers[ctx.guild.id].release(pattern)
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
+    @staticmethod
+    def unquarantine(filter_settings: dict, pattern: str) -> bool:
+        """Remove pattern from quarantine list of the filter settings."""
+
+        quarantine = filter_settings.setdefault('quarantine', [])
+        if pattern not in quarantine:
+            return False
+        quarantine.remove(pattern)
+        return True
+
+    @staticmethod
+    def save_probed(filter_settings: dict, patterns: Iterable[str] = ()):
+        """Add patterns to the probed list of the filter settings.
+
+        Patterns which are no longer in the filter are dropped from it.
+        """
+
+        probed = filter_settings.setdefault('probed', [])
+        filter_settings['probed'] = [
+            p for p in dict.fromkeys([*probed, *patterns])
+            if p in filter_settings['filter']
+        ]
+
+    def on_pattern_quarantine(self, guild_id: int, pattern: str, cost: float):
+        asyncio.get_event_loop().create_task(
+            self.quarantine_pattern(guild_id, pattern, cost)
+        )
+
+    async def quarantine_pattern(
+        self, guild_id: int, pattern: str, cost: Optional[float]
+    ):
+        """Save quarantine of a slow filter pattern and log it.
+
+        `cost` is None for patterns which failed `probe_patterns`.
+        """
+
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+
+        if cost is None:
+            log.warning(
+                f"Quarantined filter pattern {pattern!r} of {guild.name}"
+                f"({guild.id}), it timed out on a test message."
+            )
+        else:
+            log.warning(
+                f"Quarantined filter pattern {pattern!r} of {guild.name}"
+                f"({guild.id}), a search took {cost:.3f}s."
+            )
+
+        async with self.config.guild(guild).filter_messages() as f:
+            quarantine = f.setdefault('quarantine', [])
+            # scan workers can each report the same pattern
+            if pattern in quarantine:
+                return
+            quarantine.append(pattern)
+
+        settings = await self.refresh_settings(guild)
+
+        embed = discord.Embed(
+            color=self.get_event_colour('filter_messages', settings),
+            description=box(pattern),
+            timestamp=datetime.utcnow()
+        )
+        embed.set_author(name=_("Filter Pattern Quarantined"))
+        if cost is None:
+            reason = _("Searching a test message timed out.")
+        else:
+            reason = _(
+                "Searching a message took {}, more than the budget of {}."
+            ).format(
+                format_us(cost * 1_000_000),
+                format_us(self.filter_matchers[guild_id].budget * 1_000_000)
+            )
+        embed.add_field(name=_("Reason"), value=reason)
+        embed.set_footer(text=_("The pattern is no longer searched."))
+
+        await self.send_log_msg(guild, embed, settings)
+
     @commands.group(name='invites')
     @commands.guild_only()
     @commands.admin_or_permissions()
@@ -417,6 +880,7 @@ class AutoMod(commands.Cog):
         async with self.config.guild(ctx.guild).filter_invites() as f:
             f['whitelist'].append(server_id)
 
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
     @_invites.command(name='view')
@@ -462,6 +926,7 @@ class AutoMod(commands.Cog):
             except ValueError:
                 pass
 
+        await self.refresh_settings(ctx.guild)
         await ctx.message.add_reaction(check_mark)
 
     @_automod.command(name='settings')
@@ -470,7 +935,7 @@ class AutoMod(commands.Cog):
 
         guild: discord.Guild = ctx.guild
 
-        settings = await self.config.guild(guild).all()
+        settings = await self.get_guild_settings(guild)
         general_sets = await self.get_settings(guild, settings)
 
         embed=discord.Embed(
@@ -478,125 +943,445 @@ class AutoMod(commands.Cog):
             description=general_sets,
             title="AutoMod Settings"
         )
-        embed = self.ignore_fields(guild, settings, embed)
+        embed = self.ignore_fields(self.ignore_index[guild.id], embed)
         try:
             await ctx.send(embed=embed)
         except discord.Forbidden:
             await ctx.send(_("Please give me embed link permissions."))
 
+    @_automod.command(name='stats')
+    async def _automod_stats(self, ctx: Context, scope: str = None):
+        """Show time spent in automod checks and rule counters.
+
+        Use `[p]automod stats all` to list servers which spend the most
+        time in automod. Only bot owners can do that.
+        """
+
+        if scope == 'all':
+            if not await ctx.bot.is_owner(ctx.author):
+                return await ctx.send(
+                    _("Only bot owners can view stats of all servers.")
+                )
+            return await self.send_top_guilds(ctx)
+
+        guild = ctx.guild
+        stats = self.stats.get(guild.id)
+        if not stats:
+            return await ctx.send(_("No messages checked yet."))
+
+        info = format_stages(stats)
+        info += _("\n\nTriggers: {}").format(format_counter(stats.triggers))
+        info += _("\nActions: {}").format(format_counter(stats.actions))
+        execution = self.executor.latency.get(guild.id)
+        if execution:
+            info += _(
+                "\nAction execution: {} plans, mean {}, p99 {}, {} queued,"
+                " {} failed"
+            ).format(
+                execution.count,
+                format_us(execution.mean),
+                format_us(execution.percentile(99)),
+                self.executor.depth(guild.id),
+                self.executor.failed[guild.id]
+            )
+        info += _(
+            "\nInvite cache: {} hits, {} misses, {} known server codes used"
+        ).format(
+            self.invites.hits, self.invites.misses, self.invite_index.hits
+        )
+        if self.scan_pool is not None:
+            info += _(
+                "\nScan pool: {} workers, {} searches, {} timed out, {}"
+            ).format(
+                len(self.scan_pool),
+                self.scan_pool.searches,
+                self.scan_pool.timeouts,
+                _("used by this server")
+                if self.scan_pool.has_guild(guild.id)
+                else _("not used by this server")
+            )
+        info += _("\nLog queue: {} queued, {} sent, {} dropped").format(
+            self.log_dispatcher.depth(guild.id),
+            self.log_dispatcher.sent[guild.id],
+            self.log_dispatcher.dropped[guild.id]
+        )
+
+        for page in pagify(info, page_length=1900):
+            await ctx.send(box(page))
+
+    async def send_top_guilds(self, ctx: Context, count: int = 15):
+        """Send table of guilds which spend the most time in automod."""
+
+        top = sorted(
+            self.stats.items(), key=lambda i: i[1].total_time, reverse=True
+        )[:count]
+
+        if not top:
+            return await ctx.send(_("No messages checked yet."))
+
+        lines = [f"{'Server':<28}{'Messages':>10}{'Total':>10}{'Triggers':>10}"]
+        for guild_id, stats in top:
+            guild = self.bot.get_guild(guild_id)
+            name = guild.name[:26] if guild else str(guild_id)
+            lines.append(
+                f"{name:<28}{stats.stages['total'].count:>10}"
+                f"{format_us(stats.total_time):>10}"
+                f"{sum(stats.triggers.values()):>10}"
+            )
+
+        await ctx.send(box("\n".join(lines)))
+
+    @_automod.command(name='trackers')
+    @commands.is_owner()
+    async def _automod_trackers(self, ctx: Context):
+        """Show size and memory usage of the spam trackers."""
+
+        lines = [
+            f"{'Tracker':<14}{'Keys':>10}{'Entries':>10}"
+            f"{'Memory':>12}{'Evicted':>10}"
+        ]
+        for name, tracker in (
+            ('messages', self.messages),
+            ('attachments', self.attachments),
+            ('duplicates', self.duplicates),
+        ):
+            keys, entries = tracker.size()
+            memory = tracker.memory_usage() / 2 ** 20
+            lines.append(
+                f"{name:<14}{keys:>10}{entries:>10}"
+                f"{memory:>10.2f}MB{tracker.evicted:>10}"
+            )
+
+        lines.append(
+            _("\nAt most {} keys per tracker, idle keys kept for {}s.").format(
+                self.messages.max_keys, self.messages.max_idle
+            )
+        )
+        await ctx.send(box("\n".join(lines)))
+
+    @_automod.command(name='scanpool')
+    @commands.is_owner()
+    async def _automod_scanpool(self, ctx: Context, processes: int):
+        """Search large message filters in worker processes.
+
+        Servers with at least 200 regex filter patterns have their
+        messages searched by `processes` worker processes, so the search
+        doesn't block the bot. Smaller filters are still searched in the
+        bot's process. Use 0 to stop the workers.
+        """
+
+        if processes < 0 or processes > (os.cpu_count() or 1) * 2:
+            return await ctx.send(_("Invalid number of processes."))
+
+        await self.config.scan_processes.set(processes)
+        await self.start_scan_pool(processes)
+
+        if processes:
+            await ctx.send(
+                _("Started {} scan worker processes.").format(processes)
+            )
+        else:
+            await ctx.send(_("Stopped scan worker processes."))
+
+    @_automod.group(name='shadow')
+    async def _automod_shadow(self, ctx: Context):
+        """Trial automod events without deleting, muting or logging.
+
+        Events in shadow mode are checked as usual, but actions they
+        would take are only recorded and shown by `[p]automod shadow`.
+        """
+
+        if not ctx.invoked_subcommand:
+            await ctx.invoke(
+                self.bot.get_command('automod shadow summary')
+            )
+
+    @_automod_shadow.command(name='toggle')
+    async def _automod_shadow_toggle(self, ctx: Context, *events: Event):
+        """Toggle shadow mode of specified, space separated, events.
+
+        The following are valid events:
+        `mention_spam`
+        `message_spam`
+        `attachment_spam`
+        `duplicate_spam`
+        `filter_invites`
+        `filter_messages`
+        """
+
+        guild = ctx.guild
+
+        if not events:
+            return await ctx.send("Invalid events!")
+
+        changes = ""
+
+        async with self.config.guild(guild).shadow() as shadow:
+            for event in events:
+                if event.name in shadow:
+                    shadow.remove(event.name)
+                    new = False
+                else:
+                    shadow.append(event.name)
+                    new = True
+                changes += f"\n`{event.name}`: `{new}`"
+
+        await self.refresh_settings(guild)
+
+        await ctx.send(
+            _("Updated shadow mode of the following:\n{}").format(changes)
+        )
+
+    @_automod_shadow.command(name='summary')
+    async def _automod_shadow_summary(self, ctx: Context):
+        """Show actions events in shadow mode would have taken."""
+
+        guild = ctx.guild
+        settings = await self.get_guild_settings(guild)
+        shadowed = ", ".join(settings['shadow']) or _("None")
+
+        info = _("Shadowed events: {}").format(shadowed)
+        info += _("\nTriggers: {}").format(
+            format_counter(self.shadow_log.triggers[guild.id])
+        )
+        info += _("\nWould-be actions: {}").format(
+            format_counter(self.shadow_log.actions[guild.id])
+        )
+
+        recent = self.shadow_log.recent(guild.id)
+        if recent:
+            info += _("\n\nLatest triggers:\n")
+            info += (
+                f"{'Time':<10}{'Event':<17}{'User':<20}"
+                f"{'Deletes':>8}{'Mute':>6}  Detail"
+            )
+            for entry in recent:
+                info += (
+                    f"\n{entry.time:%H:%M:%S}  {entry.event:<17}"
+                    f"{entry.author_id:<20}{entry.deletes:>8}"
+                    f"{'yes' if entry.mute else 'no':>6}  {entry.detail}"
+                )
+
+        for page in pagify(info, page_length=1900):
+            await ctx.send(box(page))
+
+    @_automod_shadow.command(name='clear')
+    async def _automod_shadow_clear(self, ctx: Context):
+        """Clear shadow mode triggers of the server."""
+
+        self.shadow_log.clear(ctx.guild.id)
+        await ctx.send(_("Cleared shadow mode triggers."))
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if not message.guild.id:
+        if not message.guild:
             return
 
         if message.author == message.guild.me:
             return
 
-        if await is_mod_or_superior(bot=self.bot, obj=message):
+        timer = StageTimer(self.stats[message.guild.id])
+        try:
+            await self.automod_message(message, timer)
+        finally:
+            timer.finish()
+
+    async def automod_message(
+        self, message: discord.Message, timer: StageTimer
+    ):
+        """Run automod checks on the message and act on violations."""
+
+        if await self.mod_roles.is_mod_or_superior(message.author):
             return
+        timer.lap('mod_check')
 
-        settings = await self.config.guild(message.guild).all()
+        settings = await self.get_guild_settings(message.guild)
+        timer.lap('settings')
 
-        if self.is_ignored_group(message, settings):
+        if self.is_ignored_group(message):
             return
+        timer.lap('ignore_check')
+
+        state = RuleContext(message, settings, time.monotonic())
+        event = await self.run_rules(state, timer)
+
+        if event:
+            timer.stats.triggers[event] += 1
+            plan = self.plan_action(
+                event, message, settings, state.invite, state.match, state.fp
+            )
+            await self.executor.submit(
+                message.guild.id, self.execute_plan, plan
+            )
+            timer.lap('actions')
+
+        self.track_message(state)
 
-        # mention spam
+    async def run_rules(
+        self, state: RuleContext, timer: StageTimer
+    ) -> Optional[str]:
+        """Run the guild's rule plan on the message and return triggered event.
+
+        Rules in shadow mode are recorded when they trigger, and the plan
+        goes on with the next rule.
+        """
+
+        message = state.message
+        event = None
+
+        for rule, check, is_async, shadow in self.rule_plans[message.guild.id]:
+            triggered = await check(state) if is_async else check(state)
+            timer.lap(rule)
+            if not triggered:
+                continue
+            if shadow:
+                self.record_shadow(rule, message, state.settings, state)
+                continue
+            event = rule
+            break
+
+        # fingerprint is recorded even if an earlier rule triggered
         if (
-            settings['mention_spam']['enabled']
-            and self.is_event_set(settings['mention_spam'])
-            and self.total_mentions(message) 
-                > settings['mention_spam']['limit']
+            state.fp is None
+            and is_rule_enabled('duplicate_spam', state.settings)
         ):
-            await message.delete()
+            state.fp = fingerprint(message.content)
 
-            if settings['mention_spam']['mute']:
-                await self.spam_mute(message)
-            
-            await self.mention_spam_log(message, settings)
+        return event
 
-        # attachment spam
-        elif (
-            message.attachments
-            and settings['attachment_spam']['enabled']
-            and self.attachment_spam_condition(
-                message, settings['attachment_spam']
-            )
-        ):
-            await message.delete()
-            msg_ids = self.attachments.get(message.author.id)
-            for m_id in msg_ids:
-                try:
-                    msg = await message.channel.fetch_message(m_id)
-                    await msg.delete()
-                except discord.NotFound:
-                    pass
-            
-            if settings['attachment_spam']['mute']:
-                await self.spam_mute(message)
+    def track_message(self, state: RuleContext):
+        """Record the message in the spam trackers."""
 
-            await self.attachment_spam_log(message, settings, 1+len(msg_ids))
+        message = state.message
+        duration = state.settings['automod_duration']
+        key = self.spam_key(message)
+        msg_ref = (message.channel.id, message.id)
 
-        # message spam
-        elif (
-            settings['message_spam']['enabled']
-            and self.message_spam_condition(
-                message, settings['message_spam']
-            )
-        ):
-            await message.delete()
-            msg_ids = self.messages.get(message.author.id)
-            for m_id in msg_ids:
-                try:
-                    msg = await message.channel.fetch_message(m_id)
-                    await msg.delete()
-                except discord.NotFound:
-                    pass
+        self.messages.add(key, msg_ref, duration, state.now)
+        if message.attachments:
+            self.attachments.add(key, msg_ref, duration, state.now)
+        if state.fp is not None:
+            self.duplicates.add(key, state.fp, msg_ref, duration, state.now)
 
-            if settings['message_spam']['mute']:
-                await self.spam_mute(message)
+    def record_shadow(
+        self,
+        event: str,
+        message: discord.Message,
+        settings: dict,
+        state: RuleContext
+    ):
+        """Record actions the shadowed rule would take, without taking them.
 
-            await self.message_spam_log(message, settings, 1+len(msg_ids))
+        Tracker entries are still claimed, so the shadow log sees the same
+        triggers the rule would cause when enforced.
+        """
 
-        # invites
-        elif settings['filter_invites']['enabled']:
-            whitelist = settings['filter_invites']['whitelist']
+        plan = self.plan_action(
+            event, message, settings, state.invite, state.match, state.fp
+        )
+        if plan.match:
+            detail = plan.match.pattern
+        elif plan.invite:
+            detail = getattr(plan.invite, 'code', plan.invite)
+        else:
+            detail = ""
+
+        self.shadow_log.record(message.guild.id, ShadowEntry(
+            time=datetime.utcnow(),
+            event=event,
+            author_id=message.author.id,
+            channel_id=message.channel.id,
+            deletes=len(plan.msg_refs),
+            mute=plan.mute,
+            detail=detail
+        ))
+
+    @staticmethod
+    def spam_key(message: discord.Message) -> Tuple[int, int]:
+        """Return key of the message author in the spam trackers.
+
+        Counts are kept per guild, so activity in one guild never adds
+        up with activity of the same user in another guild.
+        """
 
-            invite_match = re.findall(invite_regex, message.content)
-            if invite_match:
-                try:
-                    invite = await self.bot.fetch_invite(invite_match[-1][-1])
-                    if not (
-                        invite.guild.id == message.guild.id
-                        or invite.guild.id in whitelist
-                    ):
-                        await message.delete()
-                        await self.invite_log(message, settings, invite)
-                except discord.NotFound:
-                    await message.delete()
-                    await self.invite_log(message, settings, invite_match[-1][-1])
+        return message.guild.id, message.author.id
 
-        # message filter
-        if (
-            settings['filter_messages']['enabled']
-        ):
-            filter_ = settings['filter_messages']['filter']
-            for pattern in filter_:
-                match = re.search(pattern, message.content)
-                if match:
-                    await message.delete()
-                    await self.filter_log(message, settings, match)
+    def plan_action(
+        self,
+        event: str,
+        message: discord.Message,
+        settings: dict,
+        invite: Union[discord.Invite, str, None] = None,
+        match: FilterMatch = None,
+        fp: int = None
+    ) -> ActionPlan:
+        """Return plan of actions to take for the triggered event.
+
+        Spam entries of the author are claimed here, so the same burst
+        isn't planned twice while the first plan is still executing.
+        """
 
-        if message.attachments:
-            self.attachments[message.author.id].append(message.id)
-            self.messages[message.author.id].append(message.id)
-            await asyncio.sleep(settings['automod_duration'])
-            self.attachments[message.author.id].remove(message.id)
-            self.messages[message.author.id].remove(message.id)
-            return 
+        key = self.spam_key(message)
+        if event == 'attachment_spam':
+            msg_refs = self.attachments.pop(key)
+        elif event == 'message_spam':
+            msg_refs = self.messages.pop(key)
+        elif event == 'duplicate_spam':
+            msg_refs = self.duplicates.pop(key, fp)
+        else:
+            msg_refs = []
+        msg_refs.append((message.channel.id, message.id))
+
+        return ActionPlan(
+            event=event,
+            message=message,
+            settings=settings,
+            msg_refs=msg_refs,
+            mute=bool(settings[event].get('mute')),
+            invite=invite,
+            match=match
+        )
+
+    async def execute_plan(self, plan: ActionPlan):
+        """Delete messages and mute the author concurrently, then log."""
 
-        self.messages[message.author.id].append(message.id)
-        await asyncio.sleep(settings['automod_duration'])
-        self.messages[message.author.id].remove(message.id)
+        message = plan.message
+        settings = plan.settings
+        actions = self.stats[message.guild.id].actions
+
+        steps = [self.delete_messages(message.guild, plan.msg_refs)]
+        if plan.mute:
+            steps.append(self.spam_mute(message))
+
+        calls, *results = await asyncio.gather(*steps, return_exceptions=True)
+        for result in (calls, *results):
+            if isinstance(result, Exception):
+                log.exception("Error in automod action.", exc_info=result)
+
+        if isinstance(calls, Exception):
+            calls = len(plan.msg_refs)
+        actions['delete'] += calls
+        if plan.mute:
+            actions['mute'] += 1
+
+        total = len(plan.msg_refs)
+        # fetching and deleting each message costs two calls, except
+        # for the triggering message which only had to be deleted
+        saved = 2 * total - 1 - calls
+
+        if plan.event == 'mention_spam':
+            await self.mention_spam_log(message, settings)
+        elif plan.event == 'attachment_spam':
+            await self.attachment_spam_log(message, settings, total, saved)
+        elif plan.event == 'message_spam':
+            await self.message_spam_log(message, settings, total, saved)
+        elif plan.event == 'duplicate_spam':
+            await self.duplicate_spam_log(message, settings, total, saved)
+        elif plan.event == 'filter_invites':
+            await self.invite_log(message, settings, plan.invite)
+        else:
+            await self.filter_log(message, settings, plan.match)
+        actions['log'] += 1
 
     async def get_settings(self, guild: discord.Guild, settings: dict):
         """Return string containing general automod settings."""
@@ -612,6 +1397,7 @@ class AutoMod(commands.Cog):
         mention_spam = settings['mention_spam']
         message_spam = settings['message_spam']
         attachment_spam = settings['attachment_spam']
+        duplicate_spam = settings['duplicate_spam']
         filter_invites = settings['filter_invites']
         filter_messages = settings['filter_messages']
 
@@ -654,30 +1440,42 @@ class AutoMod(commands.Cog):
         else:
             info += f"\n`attachment_spam`: `Not Enabled`"
 
+        if duplicate_spam['enabled']:
+            info += "\n`duplicate_spam`: `Enabled`"
+
+            if self.is_event_set(duplicate_spam):
+                info += (
+                    f" (Limit: {duplicate_spam['limit']} identical messages"
+                    f" per {settings['automod_duration']} seconds)"
+                )
+            else:
+                info += " (Not set)"
+        else:
+            info += "\n`duplicate_spam`: `Not Enabled`"
+
         info += f"\n`filter_invites`: `{filter_invites['enabled']}`"
         info += f"\n`filter_messages`: `{filter_messages['enabled']}`"
 
+        if settings['shadow']:
+            shadowed = ", ".join(f"`{e}`" for e in settings['shadow'])
+            info += f"\n\nShadow mode: {shadowed}"
+
         return info
 
-    def ignore_fields(
-        self, guild: discord.Guild, settings: dict, embed: discord.Embed
-    ):
+    def ignore_fields(self, ignored: IgnoreIndex, embed: discord.Embed):
         """Add ignored fields to embed."""
 
-        # settings = await self.config.guild(guild)
-        ignored = settings['ignored']
-
         role_info = ""
-        for role_id in ignored['roles']:
-            role_info += f"\n{guild.get_role(role_id).mention}"
+        for role_id in sorted(ignored.roles):
+            role_info += f"\n<@&{role_id}>"
 
         member_info = ""
-        for member_id in ignored['members']:
-            member_info += f"\n{guild.get_member(member_id).mention}"
+        for member_id in sorted(ignored.members):
+            member_info += f"\n<@{member_id}>"
 
         channel_info = ""
-        for channel_id in ignored['channels']:
-            channel_id += f"\n{guild.get_channel(channel_id).mention}"
+        for channel_id in sorted(ignored.channels):
+            channel_info += f"\n<#{channel_id}>"
 
         embed.add_field(
             name="Ignored Roles", value=role_info.strip() or "No roles"
@@ -704,24 +1502,189 @@ class AutoMod(commands.Cog):
 
         return is_set
 
-    def message_spam_condition(self, m: discord.Message, spam_settings):
+    def compile_rule_plan(self, settings: dict, pooled: bool = False) -> list:
+        """Return `(event, check, is_async, shadow)` of the enabled rules.
+
+        If `pooled`, the message filter is searched in the scan pool.
+        """
+
+        shadowed = set(settings['shadow'])
+        plan = []
+        for event in compile_rules(settings):
+            if event == 'filter_messages' and pooled:
+                check = self.check_filter_messages_pooled
+            elif event == 'filter_invites' and event in shadowed:
+                check = self.check_filter_invites_cached
+            else:
+                check = getattr(self, f'check_{event}')
+            plan.append((
+                event, check, asyncio.iscoroutinefunction(check),
+                event in shadowed
+            ))
+        return plan
+
+    def check_mention_spam(self, state: RuleContext):
+        return (
+            self.total_mentions(state.message)
+            > state.settings['mention_spam']['limit']
+        )
+
+    def check_attachment_spam(self, state: RuleContext):
+        return state.message.attachments and self.attachment_spam_condition(
+            state.message, state.settings, state.now
+        )
+
+    def check_message_spam(self, state: RuleContext):
+        return self.message_spam_condition(state.message, state.settings, state.now)
+
+    def check_duplicate_spam(self, state: RuleContext):
+        state.fp = fingerprint(state.message.content)
+        return state.fp is not None and self.duplicate_spam_condition(
+            state.message, state.settings, state.fp, state.now
+        )
+
+    async def check_filter_invites(self, state: RuleContext):
+        message = state.message
+        codes = dict.fromkeys(
+            match[-1] for match in invite_regex.findall(message.content)
+        )
+        if not codes:
+            return False
+
+        guild = message.guild
+        whitelist = state.settings['filter_invites']['whitelist']
+
+        self.invite_index.ensure_fresh(guild)
+        for guild_id in whitelist:
+            whitelisted = self.bot.get_guild(guild_id)
+            if whitelisted:
+                self.invite_index.ensure_fresh(whitelisted)
+
+        for code in codes:
+            # codes of this server and whitelisted servers need no lookup
+            owner = self.invite_index.guild_of(code)
+            if owner is not None and (owner == guild.id or owner in whitelist):
+                continue
+
+            invite = await self.invites.get(code)
+            if invite is None:
+                state.invite = code
+                return True
+            if not (
+                invite.guild.id == guild.id or invite.guild.id in whitelist
+            ):
+                state.invite = invite
+                return True
+
+        return False
+
+    def check_filter_invites_cached(self, state: RuleContext):
+        """Check invites using only cached and indexed codes.
+
+        Used in shadow mode, so a rule on trial makes no API requests.
+        Codes that aren't cached are let through.
+        """
+
+        message = state.message
+        codes = dict.fromkeys(
+            match[-1] for match in invite_regex.findall(message.content)
+        )
+        if not codes:
+            return False
+
+        guild = message.guild
+        whitelist = state.settings['filter_invites']['whitelist']
+
+        for code in codes:
+            owner = self.invite_index.guild_of(code)
+            if owner is not None and (owner == guild.id or owner in whitelist):
+                continue
+
+            cached, invite = self.invites.peek(code)
+            if not cached:
+                continue
+            if invite is None:
+                state.invite = code
+                return True
+            if not (
+                invite.guild.id == guild.id or invite.guild.id in whitelist
+            ):
+                state.invite = invite
+                return True
+
+        return False
+
+    def check_filter_messages(self, state: RuleContext):
+        matcher = self.filter_matchers[state.message.guild.id]
+        state.match = matcher.search(state.message.content)
+        return state.match is not None
+
+    async def check_filter_messages_pooled(self, state: RuleContext):
+        pool = self.scan_pool
+        if pool is None:
+            return self.check_filter_messages(state)
+
+        try:
+            state.match = await pool.search(
+                state.message.guild.id, state.message.content
+            )
+        except ScanTimeout:
+            # searching it in the event loop would block the bot
+            log.warning(
+                f"Skipped filter of message {state.message.id}, searching"
+                f" it timed out."
+            )
+            self.find_slow_patterns(
+                state.message.guild.id, state.message.content
+            )
+            return False
+        except ScanPoolError:
+            return self.check_filter_messages(state)
+        return state.match is not None
+
+    def message_spam_condition(
+        self, m: discord.Message, settings: dict, now: float
+    ):
+        spam_settings = settings['message_spam']
         if not self.is_event_set(spam_settings):
             return
         if (
-            len(self.messages.get(m.author.id, []))
+            self.messages.count(
+                self.spam_key(m), settings['automod_duration'], now
+            )
             > spam_settings['limit']
         ):
             return True
 
-    def attachment_spam_condition(self, m: discord.Message, spam_settings):
+    def attachment_spam_condition(
+        self, m: discord.Message, settings: dict, now: float
+    ):
+        spam_settings = settings['attachment_spam']
         if not self.is_event_set(spam_settings):
             return
         if (
-            len(self.attachments.get(m.author.id, []))
+            self.attachments.count(
+                self.spam_key(m), settings['automod_duration'], now
+            )
             >= spam_settings['limit']
         ):
             return True
 
+    def duplicate_spam_condition(
+        self, m: discord.Message, settings: dict, fp: int, now: float
+    ):
+        spam_settings = settings['duplicate_spam']
+        if not self.is_event_set(spam_settings):
+            return
+        # the message itself is the last of `limit` identical messages
+        if (
+            self.duplicates.count(
+                self.spam_key(m), fp, settings['automod_duration'], now
+            )
+            >= spam_settings['limit'] - 1
+        ):
+            return True
+
     async def cog_command_error(self, ctx: Context, error: Exception):
         if not isinstance(
             getattr(error, "original", error),
@@ -749,20 +1712,21 @@ class AutoMod(commands.Cog):
             reason="Automatic spam detection", silent=True
         )
 
-    def is_ignored_group(self, message: discord.Message, settings: dict):
+    def is_ignored_group(self, message: discord.Message):
         """Check if the message is from or in an ignored group."""
 
-        ignored = settings['ignored']
+        ignored = self.ignore_index[message.guild.id]
 
-        if message.author.id in ignored['members']:
+        if message.author.id in ignored.members:
             return True
 
-        if message.channel.id in ignored['channels']:
+        if message.channel.id in ignored.channels:
             return True
 
-        for role in message.author.roles:
-            if role.id in ignored['roles']:
-                return True
+        if ignored.roles and not ignored.roles.isdisjoint(
+            role.id for role in message.author.roles
+        ):
+            return True
 
     async def mention_spam_log(self, message: discord.Message, settings: dict):
         """Send embed with mention spam log message."""
@@ -794,7 +1758,11 @@ class AutoMod(commands.Cog):
         await self.send_log_msg(message.guild, embed, settings)
 
     async def attachment_spam_log(
-        self, message: discord.Message, settings: dict, total: int
+        self,
+        message: discord.Message,
+        settings: dict,
+        total: int,
+        calls_saved: int = 0
     ):
         """Send embed with attachment spam log message."""
 
@@ -817,6 +1785,8 @@ class AutoMod(commands.Cog):
             )
         )
 
+        embed.add_field(name="API Calls Saved", value=str(calls_saved))
+
         embed.set_author(
             name=_("{} - {} Messages Deleted").format(message.author, total),
             icon_url=message.author.avatar_url
@@ -826,7 +1796,11 @@ class AutoMod(commands.Cog):
         await self.send_log_msg(message.guild, embed, settings)
 
     async def message_spam_log(
-        self, message: discord.Message, settings: dict, total: int
+        self,
+        message: discord.Message,
+        settings: dict,
+        total: int,
+        calls_saved: int = 0
     ):
         """Send embed with message spam log message."""
 
@@ -849,6 +1823,46 @@ class AutoMod(commands.Cog):
             )
         )
 
+        embed.add_field(name="API Calls Saved", value=str(calls_saved))
+
+        embed.set_author(
+            name=_("{} - {} Messages Deleted").format(message.author, total),
+            icon_url=message.author.avatar_url
+        )
+        embed.set_footer(text=_("User ID: {}").format(message.author.id))
+
+        await self.send_log_msg(message.guild, embed, settings)
+
+    async def duplicate_spam_log(
+        self,
+        message: discord.Message,
+        settings: dict,
+        total: int,
+        calls_saved: int = 0
+    ):
+        """Send embed with duplicate spam log message."""
+
+        embed = discord.Embed(
+            color=self.get_event_colour('duplicate_spam', settings),
+            description=message.content,
+            timestamp=message.created_at
+        )
+
+        embed.add_field(
+            name="Channel",
+            value=message.channel.mention
+        )
+
+        embed.add_field(
+            name="Reason",
+            value=_("Duplicate Spam ({} identical messages/{} secs)").format(
+                settings['duplicate_spam']['limit'],
+                settings['automod_duration']
+            )
+        )
+
+        embed.add_field(name="API Calls Saved", value=str(calls_saved))
+
         embed.set_author(
             name=_("{} - {} Messages Deleted").format(message.author, total),
             icon_url=message.author.avatar_url
@@ -896,7 +1910,7 @@ class AutoMod(commands.Cog):
         await self.send_log_msg(message.guild, embed, settings)
 
     async def filter_log(
-        self, message: discord.Message, settings: dict, match: re.Match
+        self, message: discord.Message, settings: dict, match: FilterMatch
     ):
         """Send embed with message filter log message."""
 
@@ -911,7 +1925,9 @@ class AutoMod(commands.Cog):
             value=message.channel.mention
         )
 
-        reason = _("Filtered Word (Match: `{}`)").format(match.group())
+        reason = _("Filtered Word (Match: `{}`, Pattern: `{}`)").format(
+            match.text, match.pattern
+        )
 
         embed.add_field(name="Reason",value=reason)
 
@@ -926,7 +1942,7 @@ class AutoMod(commands.Cog):
     async def send_log_msg(
         self, guild: discord.Guild, embed: discord.Embed, settings: dict
     ):
-        """Send message to the log."""
+        """Queue message to be sent to the log."""
 
         log_id = settings['log_channel']
         if log_id:
@@ -934,10 +1950,66 @@ class AutoMod(commands.Cog):
         else:
             log_channel = None
 
-        if log:
-            await log_channel.send(embed=embed)
+        if log_channel:
+            self.log_dispatcher.dispatch(log_channel, embed)
         else:
-            log.exception("Could not log automod event: log_channel was `None`.")
+            log.error("Could not log automod event: log_channel was `None`.")
+
+    async def delete_messages(
+        self, guild: discord.Guild, msg_refs: Iterable[Tuple[int, int]]
+    ) -> int:
+        """Delete messages referenced by `(channel_id, message_id)` pairs.
+
+        Messages are bulk deleted per channel, 100 at a time. Messages
+        too old to be bulk deleted are deleted one by one.
+
+        Returns the number of API calls made.
+        """
+
+        by_channel = defaultdict(dict)
+        for channel_id, message_id in msg_refs:
+            by_channel[channel_id][message_id] = None
+
+        cutoff = datetime.utcnow() - bulk_delete_max_age
+        calls = 0
+
+        for channel_id, message_ids in by_channel.items():
+            channel = guild.get_channel(channel_id)
+            if channel is None:
+                continue
+
+            recent = []
+            old = []
+            for message_id in message_ids:
+                # aware on discord.py 2.x, naive on 1.x
+                created = discord.utils.snowflake_time(message_id)
+                if created.replace(tzinfo=None) > cutoff:
+                    recent.append(discord.Object(id=message_id))
+                else:
+                    old.append([discord.Object(id=message_id)])
+
+            batches = [recent[i:i+100] for i in range(0, len(recent), 100)]
+            batches.extend(old)
+
+            for batch in batches:
+                calls += 1
+                try:
+                    await channel.delete_messages(batch)
+                except discord.NotFound:
+                    pass
+                except discord.Forbidden:
+                    log.info(
+                        f"Missing permissions to delete messages in"
+                        f" {channel.name}({channel.id})."
+                    )
+                    break
+                except discord.HTTPException as e:
+                    log.exception(
+                        f"Could not delete {len(batch)} messages in"
+                        f" {channel.name}({channel.id}).", exc_info=e
+                    )
+
+        return calls
 
     def total_mentions(self, message: discord.Message):
         """Return total number of mentions, including role mentions.
@@ -954,6 +2026,7 @@ class AutoMod(commands.Cog):
             'mention_spam': discord.Colour.dark_orange(),
             'message_spam': discord.Colour.dark_red(),
             'attachment_spam': discord.Colour.magenta(),
+            'duplicate_spam': discord.Colour.red(),
             'filter_invites': discord.Colour.dark_magenta(),
             'filter_messages': discord.Colour.purple()
         }
@@ -965,7 +2038,64 @@ class AutoMod(commands.Cog):
         else:
             return defaults[event]
 
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx: Context):
+        if ctx.guild and ctx.command.qualified_name in ROLE_SETTING_COMMANDS:
+            self.mod_roles.invalidate(ctx.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.mod_roles.invalidate(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_invite_create(self, invite: discord.Invite):
+        if invite.guild:
+            self.invite_index.add(invite.guild.id, invite.code)
+
+    @commands.Cog.listener()
+    async def on_invite_delete(self, invite: discord.Invite):
+        self.invite_index.discard(invite.code)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.mod_roles.invalidate(guild.id)
+        self.settings_cache.pop(guild.id, None)
+        self.stats.pop(guild.id, None)
+        self.filter_matchers.pop(guild.id, None)
+        self.rule_plans.pop(guild.id, None)
+        self.shadow_log.clear(guild.id)
+        self.invite_index.remove_guild(guild.id)
+        if self.scan_pool is not None:
+            self.scan_pool.update(guild.id, [], [])
+        self.ignore_index.pop(guild.id, None)
+        self.messages.remove_guild(guild.id)
+        self.attachments.remove_guild(guild.id)
+        self.duplicates.remove_guild(guild.id)
+        self.log_dispatcher.close_guild(guild.id)
+        for tasks in (self.probe_tasks, self.slow_pattern_tasks):
+            task = tasks.pop(guild.id, None)
+            if task is not None:
+                task.cancel()
+
     def cog_unload(self):
-        pass
+        self.messages.clear()
+        self.attachments.clear()
+        self.duplicates.clear()
+        self.settings_cache.clear()
+        self.filter_matchers.clear()
+        self.rule_plans.clear()
+        self.shadow_log.clear()
+        self.ignore_index.clear()
+        self.invites.clear()
+        self.invite_index.clear()
+        self.mod_roles.invalidate()
+        self.log_dispatcher.close()
+        self.executor.close()
+        if self.scan_pool is not None:
+            self.scan_pool.close()
+        for tasks in (self.probe_tasks, self.slow_pattern_tasks):
+            for task in tasks.values():
+                task.cancel()
+            tasks.clear()
 
     __unload = cog_unload
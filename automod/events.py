@@ -9,13 +9,16 @@ GLOBAL_EVENTS = [
     'mention_spam',
     'message_spam',
     'attachment_spam',
+    'duplicate_spam',
     'filter_invites',
     'filter_messages'
 ]
 
-SPAM_EVENTS = ['mention_spam', 'message_spam', 'attachment_spam']
+SPAM_EVENTS = [
+    'mention_spam', 'message_spam', 'attachment_spam', 'duplicate_spam'
+]
 
-DURATION_EVENTS = ['message_spam', 'attachment_spam']
+DURATION_EVENTS = ['message_spam', 'attachment_spam', 'duplicate_spam']
 
 
 class Event:
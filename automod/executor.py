@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, Set
+
+from .stats import Histogram
+from .utils import queue_get
+
+log = logging.getLogger("red.automod.executor")
+
+
+class ActionExecutor:
+    """Bounded per-guild pool of workers running automod actions.
+
+    Each guild gets a queue of at most `maxsize` jobs and up to `workers`
+    workers, started when jobs arrive and stopped after `idle_timeout`
+    seconds without work. Submitting only waits when the guild's queue
+    is full, which slows the listener down instead of growing without
+    bound.
+    """
+
+    def __init__(
+        self, workers: int = 4, maxsize: int = 500, idle_timeout: float = 60
+    ):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, Set[asyncio.Task]] = defaultdict(set)
+        self._idle = Counter()
+
+        # guild id -> time from submission to completion of jobs
+        self.latency = defaultdict(Histogram)
+        self.failed = Counter()
+
+    async def submit(
+        self, guild_id: int, func: Callable[..., Awaitable], *args
+    ):
+        """Queue `func(*args)` to be run by one of the guild's workers."""
+
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = asyncio.Queue(self.maxsize)
+
+        await queue.put((perf_counter(), func, args))
+
+        workers = self._workers[guild_id]
+        if not self._idle[guild_id] and len(workers) < self.workers:
+            task = asyncio.get_event_loop().create_task(
+                self._worker(guild_id, queue)
+            )
+            workers.add(task)
+
+    def depth(self, guild_id: int) -> int:
+        """Return number of jobs of the guild waiting for a worker."""
+
+        queue = self._queues.get(guild_id)
+        return queue.qsize() if queue else 0
+
+    async def join(self):
+        """Wait until all queued jobs are done."""
+
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def _worker(self, guild_id: int, queue: asyncio.Queue):
+        try:
+            while True:
+                self._idle[guild_id] += 1
+                try:
+                    job = await queue_get(queue, self.idle_timeout)
+                finally:
+                    self._idle[guild_id] -= 1
+
+                if job is None:
+                    if queue.empty():
+                        return
+                    continue
+
+                queued_at, func, args = job
+                try:
+                    await func(*args)
+                except Exception as e:
+                    self.failed[guild_id] += 1
+                    log.exception("Error in automod action.", exc_info=e)
+
+                self.latency[guild_id].add(perf_counter() - queued_at)
+                queue.task_done()
+        finally:
+            self._workers[guild_id].discard(asyncio.current_task())
+
+    def close(self):
+        """Cancel all workers. Queued jobs are discarded."""
+
+        for workers in self._workers.values():
+            for task in workers:
+                task.cancel()
+
+        self._workers.clear()
+        self._queues.clear()
+        self._idle.clear()
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import discord
+
+log = logging.getLogger("red.automod.invites")
+
+
+class InviteCache:
+    """Bounded LRU cache of resolved invites.
+
+    Resolved invites are kept for `ttl` seconds and codes that don't
+    exist for `negative_ttl` seconds. Concurrent lookups of a code that
+    isn't cached share a single request.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[discord.Invite]],
+        maxsize: int = 1024,
+        ttl: float = 300,
+        negative_ttl: float = 60
+    ):
+        self._fetch = fetch
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        # code -> (expiry, invite or None)
+        self._cache: OrderedDict = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    async def get(self, code: str) -> Optional[discord.Invite]:
+        """Return invite with the code, or None if it doesn't exist.
+
+        Errors other than `discord.NotFound` are raised and not cached.
+        """
+
+        try:
+            expiry, invite = self._cache[code]
+        except KeyError:
+            pass
+        else:
+            if expiry > time.monotonic():
+                self._cache.move_to_end(code)
+                self.hits += 1
+                return invite
+            del self._cache[code]
+
+        future = self._in_flight.get(code)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[code] = future
+
+        try:
+            try:
+                invite = await self._fetch(code)
+            except discord.NotFound:
+                invite = None
+                ttl = self.negative_ttl
+            else:
+                ttl = self.ttl
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved if nobody else waited on it
+            future.exception()
+            raise
+        else:
+            future.set_result(invite)
+            self._store(code, invite, ttl)
+            return invite
+        finally:
+            del self._in_flight[code]
+
+    def peek(self, code: str) -> Tuple[bool, Optional[discord.Invite]]:
+        """Return `(cached, invite)` of the code without fetching it."""
+
+        try:
+            expiry, invite = self._cache[code]
+        except KeyError:
+            return False, None
+        if expiry <= time.monotonic():
+            return False, None
+        self.hits += 1
+        return True, invite
+
+    def _store(self, code: str, invite: Optional[discord.Invite], ttl: float):
+        self._cache[code] = (time.monotonic() + ttl, invite)
+        self._cache.move_to_end(code)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class GuildInviteIndex:
+    """Invite codes of guilds the bot is in, including vanity codes.
+
+    A guild's codes are fetched with `guild.invites()` when they are
+    first needed and again `refresh_interval` seconds later, and kept up
+    to date with invite create and delete events in between. Fetching
+    needs the Manage Server permission, guilds where the bot doesn't have
+    it stay empty and every code is resolved through the API.
+    """
+
+    def __init__(self, refresh_interval: float = 3600):
+        self.refresh_interval = refresh_interval
+
+        # code -> guild id
+        self._owners: Dict[str, int] = {}
+        # guild id -> codes of the guild
+        self._codes: Dict[int, Set[str]] = {}
+        # guild id -> time of next refresh
+        self._expiry: Dict[int, float] = {}
+        self._refreshing: Dict[int, asyncio.Task] = {}
+
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._owners)
+
+    def guild_of(self, code: str) -> Optional[int]:
+        """Return id of the indexed guild the code belongs to."""
+
+        guild_id = self._owners.get(code)
+        if guild_id is not None:
+            self.hits += 1
+        return guild_id
+
+    def ensure_fresh(self, guild: discord.Guild):
+        """Start a refresh of the guild's codes if they are out of date."""
+
+        if guild.id in self._refreshing:
+            return
+        if self._expiry.get(guild.id, 0) > time.monotonic():
+            return
+
+        self._refreshing[guild.id] = asyncio.get_event_loop().create_task(
+            self.refresh(guild)
+        )
+
+    async def refresh(self, guild: discord.Guild):
+        """Fetch invite codes of the guild."""
+
+        self._expiry[guild.id] = time.monotonic() + self.refresh_interval
+        try:
+            codes = set()
+            if guild.me.guild_permissions.manage_guild:
+                try:
+                    codes.update(i.code for i in await guild.invites())
+                except discord.HTTPException as e:
+                    log.warning(
+                        f"Could not fetch invites of"
+                        f" {guild.name}({guild.id}).", exc_info=e
+                    )
+                    return
+
+            vanity = getattr(guild, 'vanity_url_code', None)
+            if vanity:
+                codes.add(vanity)
+
+            self.remove_guild(guild.id, keep_expiry=True)
+            self._codes[guild.id] = codes
+            for code in codes:
+                self._owners[code] = guild.id
+        finally:
+            self._refreshing.pop(guild.id, None)
+
+    def add(self, guild_id: int, code: str):
+        """Add code created in an indexed guild."""
+
+        codes = self._codes.get(guild_id)
+        if codes is not None:
+            codes.add(code)
+            self._owners[code] = guild_id
+
+    def discard(self, code: str):
+        """Remove a deleted code."""
+
+        guild_id = self._owners.pop(code, None)
+        if guild_id is not None:
+            self._codes[guild_id].discard(code)
+
+    def remove_guild(self, guild_id: int, keep_expiry: bool = False):
+        for code in self._codes.pop(guild_id, ()):
+            if self._owners.get(code) == guild_id:
+                del self._owners[code]
+        if not keep_expiry:
+            self._expiry.pop(guild_id, None)
+
+    def clear(self):
+        for task in self._refreshing.values():
+            task.cancel()
+        self._refreshing.clear()
+        self._owners.clear()
+        self._codes.clear()
+        self._expiry.clear()
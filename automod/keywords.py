@@ -0,0 +1,98 @@
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+# characters with a special meaning in a regex. Patterns without any of
+# them match themselves literally.
+REGEX_CHARS = frozenset(".^$*+?{}[]\\|()")
+
+NOT_FOUND = float('inf')
+
+
+def is_literal(pattern: str) -> bool:
+    """Return True if the regex only matches its own text."""
+
+    return bool(pattern) and REGEX_CHARS.isdisjoint(pattern)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton finding many keywords in one pass.
+
+    Searching costs O(len(text)), no matter how many keywords there are.
+    Only the first keyword, by position in `keywords`, found in the text
+    is reported, so results match searching the keywords one by one in
+    order.
+    """
+
+    def __init__(self, keywords: Sequence[str]):
+        self.keywords = list(keywords)
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # lowest index of a keyword ending at the node, directly or
+        # through fail links
+        self._first: List[float] = [NOT_FOUND]
+
+        for index, keyword in enumerate(self.keywords):
+            self._insert(keyword, index)
+        self._link()
+
+    def _insert(self, keyword: str, index: int):
+        node = 0
+        for char in keyword:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._first.append(NOT_FOUND)
+            node = nxt
+
+        if index < self._first[node]:
+            self._first[node] = index
+
+    def _link(self):
+        goto = self._goto
+        fail = self._fail
+        first = self._first
+
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+
+                if first[fail[child]] < first[child]:
+                    first[child] = first[fail[child]]
+
+    def search(self, text: str) -> Optional[int]:
+        """Return index of the first keyword found in the text, if any."""
+
+        goto = self._goto
+        fail = self._fail
+        first = self._first
+
+        found = NOT_FOUND
+        node = 0
+        for char in text:
+            while True:
+                nxt = goto[node].get(char)
+                if nxt is not None:
+                    node = nxt
+                    break
+                if not node:
+                    break
+                node = fail[node]
+
+            if first[node] < found:
+                found = first[node]
+                if not found:
+                    break
+
+        return None if found == NOT_FOUND else found
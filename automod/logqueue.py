@@ -0,0 +1,200 @@
+import asyncio
+import inspect
+import logging
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Optional
+
+import discord
+
+from .utils import queue_get
+
+log = logging.getLogger("red.automod.logqueue")
+
+# discord.py 2.0 can send up to 10 embeds in one message. Older versions
+# can only send one embed per message, but webhooks take up to 10.
+MULTI_EMBED = 'embeds' in inspect.signature(
+    discord.abc.Messageable.send
+).parameters
+
+WEBHOOK_NAME = 'AutoMod'
+
+
+class LogDispatcher:
+    """Coalescing sender of automod log embeds.
+
+    Embeds are queued per guild and a worker packs up to `batch_size`
+    of them into one message. A batch is sent when it is full or
+    `interval` seconds after its first embed was taken from the queue.
+    Embeds that don't fit in a full queue are dropped and counted, so a
+    rate limited log channel can't hold back the message listener.
+
+    On discord.py 1.x, batches are sent through a webhook of the log
+    channel, created when the bot can manage webhooks there. Without
+    that permission, embeds are sent one message each. A worker stops
+    after `idle` seconds without embeds.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 200,
+        interval: float = 2,
+        batch_size: int = 10,
+        idle: float = 300
+    ):
+        self.maxsize = maxsize
+        self.interval = interval
+        self.batch_size = batch_size
+        self.idle = idle
+
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # guild id -> {channel id: webhook used to send batches}
+        self._webhooks: Dict[int, Dict[int, discord.Webhook]] = defaultdict(
+            dict
+        )
+
+        # guild id -> counter
+        self.sent = defaultdict(int)
+        self.dropped = defaultdict(int)
+
+    def dispatch(self, channel: discord.TextChannel, embed: discord.Embed):
+        """Queue embed to be sent in the channel."""
+
+        guild_id = channel.guild.id
+
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = asyncio.Queue(self.maxsize)
+            self._workers[guild_id] = asyncio.get_event_loop().create_task(
+                self._worker(guild_id, queue)
+            )
+
+        try:
+            queue.put_nowait((channel, embed))
+        except asyncio.QueueFull:
+            self.dropped[guild_id] += 1
+
+    def depth(self, guild_id: int) -> int:
+        """Return number of embeds waiting to be sent for the guild."""
+
+        queue = self._queues.get(guild_id)
+        return queue.qsize() if queue else 0
+
+    async def _worker(self, guild_id: int, queue: asyncio.Queue):
+        loop = asyncio.get_event_loop()
+        while True:
+            entry = await queue_get(queue, self.idle)
+            if entry is None:
+                # an embed can be queued between the timeout and now
+                if not queue.empty():
+                    continue
+                del self._queues[guild_id]
+                del self._workers[guild_id]
+                return
+
+            batch = [entry]
+            deadline = loop.time() + self.interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                entry = await queue_get(queue, timeout)
+                if entry is None:
+                    break
+                batch.append(entry)
+
+            await self._send(batch)
+
+    async def _send(self, batch: list):
+        for channel, entries in groupby(batch, key=itemgetter(0)):
+            embeds = [embed for _, embed in entries]
+            guild_id = channel.guild.id
+            try:
+                if MULTI_EMBED:
+                    await channel.send(embeds=embeds)
+                else:
+                    try:
+                        webhook = await self._webhook(channel)
+                    except discord.HTTPException as e:
+                        log.info(
+                            f"Could not get a webhook of {channel.name}"
+                            f"({channel.id}): {e}"
+                        )
+                        webhook = None
+                    if webhook is not None:
+                        await self._send_webhook(channel, webhook, embeds)
+                    else:
+                        for embed in embeds:
+                            await channel.send(embed=embed)
+            except discord.HTTPException as e:
+                self.dropped[guild_id] += len(embeds)
+                log.exception(
+                    f"Could not send {len(embeds)} automod log embeds"
+                    f" to {channel.name}({channel.id}).", exc_info=e
+                )
+            else:
+                self.sent[guild_id] += len(embeds)
+
+    async def _webhook(
+        self, channel: discord.TextChannel
+    ) -> Optional[discord.Webhook]:
+        """Return webhook of the channel, if the bot can manage webhooks."""
+
+        guild = channel.guild
+        if not channel.permissions_for(guild.me).manage_webhooks:
+            self._webhooks[guild.id].pop(channel.id, None)
+            return None
+
+        webhook = self._webhooks[guild.id].get(channel.id)
+        if webhook is None:
+            for hook in await channel.webhooks():
+                if hook.name == WEBHOOK_NAME and hook.token:
+                    webhook = hook
+                    break
+            else:
+                webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+            self._webhooks[guild.id][channel.id] = webhook
+        return webhook
+
+    async def _send_webhook(
+        self,
+        channel: discord.TextChannel,
+        webhook: discord.Webhook,
+        embeds: list
+    ):
+        me = channel.guild.me
+        try:
+            await webhook.send(
+                embeds=embeds,
+                username=me.display_name,
+                avatar_url=str(me.avatar_url)
+            )
+        except discord.NotFound:
+            # webhook was deleted, a new one is made for the next batch
+            self._webhooks[channel.guild.id].pop(channel.id, None)
+            for embed in embeds:
+                await channel.send(embed=embed)
+
+    def close_guild(self, guild_id: int):
+        """Stop the guild's worker and forget its webhooks and counters."""
+
+        task = self._workers.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+        self._queues.pop(guild_id, None)
+        self._webhooks.pop(guild_id, None)
+        self.sent.pop(guild_id, None)
+        self.dropped.pop(guild_id, None)
+
+    def close(self):
+        """Stop all workers. Embeds still in the queues are discarded."""
+
+        for task in self._workers.values():
+            task.cancel()
+
+        self._workers.clear()
+        self._queues.clear()
+        self._webhooks.clear()
@@ -0,0 +1,338 @@
+import asyncio
+import json
+import re
+import sys
+from collections import namedtuple
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Pattern, Set
+
+from .keywords import KeywordAutomaton, is_literal
+
+FilterMatch = namedtuple('FilterMatch', 'pattern text')
+
+# code run in a separate interpreter to try patterns, see `probe_patterns`.
+# Each line of input is a pattern and a text, a line is written back after
+# the pattern is searched.
+PROBE_CODE = """
+import json, re, sys
+for line in sys.stdin:
+    pattern, text = json.loads(line)
+    try:
+        re.findall(pattern, text)
+    except re.error:
+        pass
+    sys.stdout.write("\\n")
+    sys.stdout.flush()
+"""
+
+
+class PatternStats:
+    """Time spent searching sampled messages with one pattern."""
+
+    __slots__ = ('count', 'total', 'max', 'strikes')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # number of searches over budget
+        self.strikes = 0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class FilterMatcher:
+    """Compiled form of a guild's message filter.
+
+    Every pattern is compiled once and kept for the life of the filter,
+    so matching doesn't depend on the `re` module cache. Patterns are
+    searched one by one: CPython's `re` can skip ahead to the literal
+    prefix of a single pattern, but tries every branch at every position
+    of a large alternation, which is many times slower.
+
+    When there are at least `min_keywords` plain word or phrase patterns,
+    they are searched all at once with a `KeywordAutomaton` before the
+    other patterns, so their cost depends on the message length only.
+
+    The clock is read after each pattern, so a pattern which takes longer
+    than `budget` seconds is caught on the search it's slow in. After
+    `max_strikes` such searches it's quarantined: it's no longer searched,
+    and `on_quarantine` is called with the pattern and its slowest search
+    time. Every `sample_every` search also adds the time of each pattern
+    to its stats, for `profile`.
+
+    Patterns in `pending` are left out of searches without being
+    quarantined, until they are known to be safe to search.
+    """
+
+    def __init__(
+        self,
+        patterns: Iterable[str] = (),
+        quarantined: Iterable[str] = (),
+        pending: Iterable[str] = (),
+        budget: float = 0.025,
+        max_strikes: int = 1,
+        sample_every: int = 16,
+        min_keywords: int = 8,
+        on_quarantine: Callable[[str, float], None] = None
+    ):
+        self.patterns: List[str] = []
+        self.invalid: List[str] = []
+        # pattern -> slowest search, None if quarantined in an earlier run
+        self.quarantined: Dict[str, Optional[float]] = {}
+        self.pending: Set[str] = set()
+
+        self.budget = budget
+        self.max_strikes = max_strikes
+        self.sample_every = sample_every
+        self.min_keywords = min_keywords
+        self.on_quarantine = on_quarantine
+
+        self.searches = 0
+
+        # literal patterns searched by the automaton
+        self.keywords: List[str] = []
+        self.stats: Dict[str, PatternStats] = {}
+
+        self._automaton: Optional[KeywordAutomaton] = None
+        self._compiled: Dict[str, Pattern] = {}
+
+        self.update(patterns, quarantined, pending)
+
+    def update(
+        self,
+        patterns: Iterable[str],
+        quarantined: Iterable[str] = (),
+        pending: Iterable[str] = ()
+    ):
+        """Rebuild the matcher for a new list of patterns.
+
+        Patterns compiled for the previous list are reused, only new
+        patterns are compiled. Quarantined and pending patterns are
+        left out.
+        """
+
+        patterns = list(patterns)
+        quarantined = {
+            p: self.quarantined.get(p) for p in quarantined if p in patterns
+        }
+        pending = set(pending).difference(quarantined)
+        if (
+            patterns == self.patterns
+            and quarantined == self.quarantined
+            and pending == self.pending
+        ):
+            return
+
+        compiled = {}
+        invalid = []
+        for pattern in dict.fromkeys(patterns):
+            if pattern in quarantined or pattern in pending:
+                continue
+            regex = self._compiled.get(pattern)
+            if regex is None:
+                try:
+                    regex = re.compile(pattern)
+                except re.error:
+                    invalid.append(pattern)
+                    continue
+            compiled[pattern] = regex
+
+        keywords = [p for p in compiled if is_literal(p)]
+        if len(keywords) >= self.min_keywords:
+            if keywords != self.keywords:
+                self._automaton = KeywordAutomaton(keywords)
+            for keyword in keywords:
+                del compiled[keyword]
+        else:
+            keywords = []
+            self._automaton = None
+
+        self.patterns = patterns
+        self.invalid = invalid
+        self.quarantined = quarantined
+        self.pending = pending
+        self.keywords = keywords
+        self._compiled = compiled
+        self.stats = {
+            p: self.stats.get(p) or PatternStats()
+            for p in [*compiled, *quarantined]
+        }
+
+    def search(self, content: str) -> Optional[FilterMatch]:
+        """Return the first filter match in `content`, if any."""
+
+        if self._automaton is not None:
+            index = self._automaton.search(content)
+            if index is not None:
+                keyword = self.keywords[index]
+                return FilterMatch(keyword, keyword)
+
+        self.searches += 1
+        if not self.searches % self.sample_every:
+            return self._search_timed(content)
+
+        found = None
+        slow = None
+        last = perf_counter()
+        for pattern, regex in self._compiled.items():
+            match = regex.search(content)
+            now = perf_counter()
+            if now - last > self.budget:
+                slow = (pattern, now - last)
+            last = now
+            if match:
+                found = FilterMatch(pattern, match.group())
+                break
+
+        if slow is not None:
+            pattern, cost = slow
+            pattern_stats = self.stats[pattern]
+            if cost > pattern_stats.max:
+                pattern_stats.max = cost
+            self._strike(pattern)
+
+        return found
+
+    def _search_timed(self, content: str) -> Optional[FilterMatch]:
+        found = None
+        marks = [perf_counter()]
+        mark = marks.append
+
+        for pattern, regex in self._compiled.items():
+            match = regex.search(content)
+            mark(perf_counter())
+            if match:
+                found = FilterMatch(pattern, match.group())
+                break
+
+        self._record(marks)
+        return found
+
+    def _record(self, marks: List[float]):
+        """Add search times of each pattern to their stats."""
+
+        slow = None
+        for pattern, start, end in zip(self._compiled, marks, marks[1:]):
+            cost = end - start
+            pattern_stats = self.stats[pattern]
+            pattern_stats.count += 1
+            pattern_stats.total += cost
+            if cost > pattern_stats.max:
+                pattern_stats.max = cost
+            if cost > self.budget:
+                slow = pattern
+
+        if slow is not None:
+            self._strike(slow)
+
+    def _strike(self, pattern: str):
+        pattern_stats = self.stats[pattern]
+        pattern_stats.strikes += 1
+        if pattern_stats.strikes < self.max_strikes:
+            return
+
+        del self._compiled[pattern]
+        self.quarantined[pattern] = pattern_stats.max
+        if self.on_quarantine:
+            self.on_quarantine(pattern, pattern_stats.max)
+
+    def release(self, pattern: str):
+        """Search the pattern again and forget its strikes."""
+
+        if pattern not in self.quarantined:
+            return
+
+        del self.quarantined[pattern]
+        self.stats[pattern] = PatternStats()
+        self._compiled[pattern] = re.compile(pattern)
+
+    def profile(self, count: int = 10) -> List[tuple]:
+        """Return `(pattern, stats)` of the slowest patterns, by total time."""
+
+        return sorted(
+            self.stats.items(), key=lambda i: i[1].total, reverse=True
+        )[:count]
+
+
+def probe_text(pattern: str) -> str:
+    """Return text likely to make a backtracking pattern slow.
+
+    Runs of each character used in the pattern, punctuation included,
+    are followed by a character which doesn't continue the run, so
+    patterns like ``(a+)+$`` or ``(.*,){12}X`` backtrack through every
+    split of the run. Punctuation is also repeated between letters, for
+    patterns like ``(\\w+,)+$``.
+    """
+
+    chars = {c for c in pattern if c.isprintable()} | {'a', '1', ' '}
+    # not printable, so it's never in the runs
+    end = "\x00"
+    punctuation = [c for c in sorted(chars) if not c.isalnum() and c != ' ']
+    lines = [c * 32 + end for c in sorted(chars)]
+    lines += [("a" + c) * 16 + end for c in punctuation]
+    return "\n".join(lines[:96])
+
+
+async def probe_patterns(
+    patterns: Iterable[str], timeout: float = 2, text: Optional[str] = None
+) -> List[str]:
+    """Return patterns which take over `timeout` seconds on `probe_text`.
+
+    Patterns are searched one by one in a separate interpreter. When a
+    search times out the interpreter is killed, so a catastrophic
+    pattern never blocks the bot, and a new one tries the rest.
+
+    If `text` is given, every pattern is searched in it instead.
+    """
+
+    pending = list(patterns)
+    slow = []
+    while pending:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-I', '-c', PROBE_CODE,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+
+        done = 0
+        try:
+            for pattern in pending:
+                proc.stdin.write(
+                    json.dumps(
+                        [pattern, probe_text(pattern) if text is None else text]
+                    ).encode()
+                    + b"\n"
+                )
+                await proc.stdin.drain()
+
+                reply = asyncio.ensure_future(proc.stdout.readline())
+                await asyncio.wait((reply,), timeout=timeout)
+                if not reply.done():
+                    reply.cancel()
+                    slow.append(pattern)
+                    done += 1
+                    break
+                if not reply.result():
+                    # the interpreter died on this pattern
+                    slow.append(pattern)
+                    done += 1
+                    break
+                done += 1
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+
+        pending = pending[done:]
+
+    return slow
+
+
+async def probe_pattern(pattern: str, timeout: float = 2) -> bool:
+    """Return False if the pattern is too slow on `probe_text`."""
+
+    return not await probe_patterns([pattern], timeout)
@@ -0,0 +1,63 @@
+from collections import namedtuple
+from typing import Tuple
+
+import discord
+
+from .keywords import is_literal
+
+# `cost` is a rough per-message cost of the rule, in microseconds, used
+# to order the rules. Rules with `per_pattern` cost more for every
+# regex pattern in the guild's filter.
+Rule = namedtuple('Rule', 'event cost per_pattern')
+
+RULES = (
+    Rule('mention_spam', 1, 0),
+    Rule('attachment_spam', 2, 0),
+    Rule('message_spam', 3, 0),
+    Rule('duplicate_spam', 5, 0),
+    Rule('filter_invites', 5, 0),
+    Rule('filter_messages', 1, 0.5),
+)
+
+
+class RuleContext:
+    """State of one message passed through the rule pipeline.
+
+    Rules store what they found here, so later rules and the action
+    plan can reuse it.
+    """
+
+    __slots__ = ('message', 'settings', 'now', 'fp', 'invite', 'match')
+
+    def __init__(self, message: discord.Message, settings: dict, now: float):
+        self.message = message
+        self.settings = settings
+        self.now = now
+        self.fp = None
+        self.invite = None
+        self.match = None
+
+
+def is_rule_enabled(event: str, settings: dict) -> bool:
+    """Return True if the rule can trigger with the settings."""
+
+    event_settings = settings[event]
+    if not event_settings['enabled']:
+        return False
+    if 'limit' in event_settings and not event_settings['limit']:
+        return False
+    if event == 'filter_messages' and not event_settings['filter']:
+        return False
+    return True
+
+
+def compile_rules(settings: dict) -> Tuple[str, ...]:
+    """Return events of the enabled rules, cheapest rule first."""
+
+    # plain word patterns are all searched in one pass
+    patterns = sum(
+        not is_literal(p) for p in settings['filter_messages']['filter']
+    )
+    rules = [rule for rule in RULES if is_rule_enabled(rule.event, settings)]
+    rules.sort(key=lambda rule: rule.cost + rule.per_pattern * patterns)
+    return tuple(rule.event for rule in rules)
@@ -0,0 +1,292 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .keywords import is_literal
+from .matcher import FilterMatch
+
+log = logging.getLogger("red.automod.scanpool")
+
+# code run by the worker processes. The cog package is registered without
+# running its `__init__`, so workers import the matcher and nothing else.
+WORKER_CODE = """
+import importlib, json, sys, types
+
+path, name = sys.argv[1], sys.argv[2]
+package = types.ModuleType(name)
+package.__path__ = [path]
+sys.modules[name] = package
+FilterMatcher = importlib.import_module(name + '.matcher').FilterMatcher
+
+matchers = {}
+quarantined = []
+
+def on_quarantine(guild_id):
+    return lambda pattern, cost: quarantined.append([guild_id, pattern, cost])
+
+out = sys.stdout
+for line in sys.stdin:
+    request = json.loads(line)
+    op = request['op']
+    guild_id = request['guild']
+    if op == 'search':
+        matcher = matchers.get(guild_id)
+        match = matcher.search(request['content']) if matcher else None
+        out.write(json.dumps([request['id'], match, quarantined]) + '\\n')
+        out.flush()
+        quarantined.clear()
+    elif op == 'update':
+        matcher = matchers.get(guild_id)
+        if matcher is None:
+            matchers[guild_id] = FilterMatcher(
+                request['patterns'], request['quarantined'],
+                on_quarantine=on_quarantine(guild_id)
+            )
+        else:
+            matcher.update(request['patterns'], request['quarantined'])
+    elif op == 'drop':
+        matchers.pop(guild_id, None)
+"""
+
+
+class ScanPoolError(Exception):
+    """Raised when no worker could search a message."""
+
+
+class ScanTimeout(ScanPoolError):
+    """Raised when a worker took too long to search a message."""
+
+
+# seconds a worker may take to compile new filters
+WARMUP_TIMEOUT = 60
+
+
+class _Worker:
+    __slots__ = ('proc', 'reader', 'futures', 'ready')
+
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+        self.reader: Optional[asyncio.Task] = None
+        # request id -> future of a search waiting for its result
+        self.futures: Dict[int, asyncio.Future] = {}
+        # done once the worker compiled the filters sent to it
+        self.ready: Optional[asyncio.Future] = None
+
+
+class ScanPool:
+    """Pool of worker processes searching messages with guild filters.
+
+    Every worker holds the compiled filter of every guild in the pool, so
+    a search goes to the least busy worker and a single large guild can
+    use all of them. Filters are only sent to the pool when they have at
+    least `min_patterns` regex patterns, below that searching in the
+    event loop is cheaper than a round trip to a worker.
+
+    Patterns quarantined by a worker are passed to `on_quarantine` with
+    the guild id, the pattern and its slowest search time.
+
+    A worker which doesn't answer a search within `timeout` seconds is
+    killed and replaced, and the search raises `ScanTimeout`. Time spent
+    compiling filters sent before the search doesn't count.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        min_patterns: int = 200,
+        timeout: float = 1,
+        on_quarantine: Callable[[int, str, float], None] = None
+    ):
+        self.processes = processes
+        self.min_patterns = min_patterns
+        self.timeout = timeout
+        self.on_quarantine = on_quarantine
+        self._closed = False
+
+        self._workers: List[_Worker] = []
+        self._ids = itertools.count()
+        # guild id -> last update sent to the workers
+        self._filters: Dict[int, bytes] = {}
+
+        self.searches = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self._workers)
+
+    async def start(self):
+        for _ in range(self.processes):
+            await self._spawn()
+
+    async def _spawn(self):
+        package = os.path.dirname(os.path.abspath(__file__))
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-c', WORKER_CODE,
+            package, os.path.basename(package),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        if self._closed:
+            proc.kill()
+            return
+
+        worker = _Worker(proc)
+        worker.reader = asyncio.get_event_loop().create_task(
+            self._read(worker)
+        )
+        for request in self._filters.values():
+            proc.stdin.write(request)
+        self._ping(worker)
+        self._workers.append(worker)
+
+    def wants(self, patterns: Iterable[str]) -> bool:
+        """Return True if a filter with the patterns should use the pool."""
+
+        return sum(not is_literal(p) for p in patterns) >= self.min_patterns
+
+    def has_guild(self, guild_id: int) -> bool:
+        return guild_id in self._filters
+
+    def update(
+        self, guild_id: int, patterns: List[str], quarantined: List[str]
+    ):
+        """Send the guild's filter to the workers, or remove it from them."""
+
+        if not self.wants(patterns):
+            if self._filters.pop(guild_id, None) is not None:
+                self._broadcast({'op': 'drop', 'guild': guild_id})
+            return
+
+        request = self._encode({
+            'op': 'update', 'guild': guild_id,
+            'patterns': patterns, 'quarantined': quarantined
+        })
+        if self._filters.get(guild_id) != request:
+            self._filters[guild_id] = request
+            self._broadcast(request)
+
+    async def search(
+        self, guild_id: int, content: str
+    ) -> Optional[FilterMatch]:
+        """Return the first filter match in `content`, if any."""
+
+        if not self._workers:
+            raise ScanPoolError("No scan workers are running.")
+
+        worker = min(self._workers, key=lambda w: len(w.futures))
+        request_id = next(self._ids)
+        future = asyncio.get_event_loop().create_future()
+        worker.futures[request_id] = future
+
+        ready = worker.ready
+        try:
+            worker.proc.stdin.write(self._encode({
+                'op': 'search', 'id': request_id,
+                'guild': guild_id, 'content': content
+            }))
+            await worker.proc.stdin.drain()
+            if not ready.done():
+                await asyncio.wait((ready,), timeout=WARMUP_TIMEOUT)
+            await asyncio.wait((future,), timeout=self.timeout)
+        except (ConnectionError, BrokenPipeError) as e:
+            raise ScanPoolError("Scan worker stopped.") from e
+        finally:
+            worker.futures.pop(request_id, None)
+
+        if not future.done():
+            self.timeouts += 1
+            await self._replace(worker)
+            raise ScanTimeout(
+                f"Scan worker took over {self.timeout}s to search a message."
+            )
+
+        match = future.result()
+        self.searches += 1
+        return FilterMatch(*match) if match else None
+
+    async def _replace(self, worker: _Worker):
+        """Kill a stuck worker and start a new one."""
+
+        if worker not in self._workers:
+            # already replaced by another search
+            return
+
+        log.warning(f"Replacing scan worker {worker.proc.pid}, it timed out.")
+        self._workers.remove(worker)
+        worker.reader.cancel()
+        if worker.proc.returncode is None:
+            worker.proc.kill()
+        self._fail(worker, "Scan worker timed out.")
+        await self._spawn()
+
+    async def _read(self, worker: _Worker):
+        stdout = worker.proc.stdout
+        while True:
+            line = await stdout.readline()
+            if not line:
+                break
+
+            request_id, match, quarantined = json.loads(line)
+            future = worker.futures.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(match)
+
+            if quarantined and self.on_quarantine:
+                for guild_id, pattern, cost in quarantined:
+                    self.on_quarantine(guild_id, pattern, cost)
+
+        returncode = await worker.proc.wait()
+        log.error(
+            f"Scan worker {worker.proc.pid} stopped with exit code"
+            f" {returncode}."
+        )
+        if worker in self._workers:
+            self._workers.remove(worker)
+        # searches waiting on this worker are searched in the event loop
+        self._fail(worker, "Scan worker stopped.")
+
+    def _broadcast(self, request):
+        if isinstance(request, dict):
+            request = self._encode(request)
+        for worker in self._workers:
+            worker.proc.stdin.write(request)
+            self._ping(worker)
+
+    def _ping(self, worker: _Worker):
+        """Send a search which is answered once earlier requests are done."""
+
+        request_id = next(self._ids)
+        future = asyncio.get_event_loop().create_future()
+        # a failed ping is only seen through the searches after it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        worker.futures[request_id] = future
+        worker.ready = future
+        worker.proc.stdin.write(self._encode({
+            'op': 'search', 'id': request_id, 'guild': None, 'content': ''
+        }))
+
+    @staticmethod
+    def _encode(request: dict) -> bytes:
+        return json.dumps(request).encode() + b"\n"
+
+    def close(self):
+        """Stop all workers."""
+
+        self._closed = True
+        for worker in self._workers:
+            worker.reader.cancel()
+            if worker.proc.returncode is None:
+                worker.proc.kill()
+            self._fail(worker, "Scan pool closed.")
+        self._workers.clear()
+        self._filters.clear()
+
+    @staticmethod
+    def _fail(worker: _Worker, reason: str):
+        for future in worker.futures.values():
+            if not future.done():
+                future.set_exception(ScanPoolError(reason))
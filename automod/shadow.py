@@ -0,0 +1,52 @@
+from collections import Counter, defaultdict, deque, namedtuple
+from typing import Dict, List
+
+ShadowEntry = namedtuple(
+    'ShadowEntry', 'time event author_id channel_id deletes mute detail'
+)
+
+
+class ShadowLog:
+    """Per-guild record of actions that rules in shadow mode would take.
+
+    The last `maxlen` entries of each guild are kept in a ring buffer,
+    next to counters of triggers and would-be actions since the last
+    clear.
+    """
+
+    def __init__(self, maxlen: int = 100):
+        self.maxlen = maxlen
+
+        self._entries: Dict[int, deque] = {}
+        self.triggers = defaultdict(Counter)
+        self.actions = defaultdict(Counter)
+
+    def record(self, guild_id: int, entry: ShadowEntry):
+        entries = self._entries.get(guild_id)
+        if entries is None:
+            entries = self._entries[guild_id] = deque(maxlen=self.maxlen)
+        entries.append(entry)
+
+        self.triggers[guild_id][entry.event] += 1
+        actions = self.actions[guild_id]
+        actions['delete'] += entry.deletes
+        actions['log'] += 1
+        if entry.mute:
+            actions['mute'] += 1
+
+    def recent(self, guild_id: int, count: int = 10) -> List[ShadowEntry]:
+        """Return the guild's last `count` entries, newest first."""
+
+        entries = self._entries.get(guild_id, ())
+        return list(reversed(entries))[:count]
+
+    def clear(self, guild_id: int = None):
+        if guild_id is None:
+            self._entries.clear()
+            self.triggers.clear()
+            self.actions.clear()
+            return
+
+        self._entries.pop(guild_id, None)
+        self.triggers.pop(guild_id, None)
+        self.actions.pop(guild_id, None)
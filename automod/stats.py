@@ -0,0 +1,117 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from time import perf_counter
+
+# upper bounds of histogram buckets, in microseconds. Values above the
+# last bound are counted in an extra overflow bucket.
+BUCKETS = (
+    5, 10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000, 25_000,
+    100_000, 250_000, 1_000_000
+)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram."""
+
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        us = seconds * 1_000_000
+        self.counts[bisect_left(BUCKETS, us)] += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def mean(self) -> float:
+        count = self.count
+        return self.total / count if count else 0.0
+
+    def percentile(self, pct: float) -> float:
+        """Return upper bound, in microseconds, of the bucket holding `pct`."""
+
+        target = self.count * pct / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max
+
+
+class GuildStats:
+    """Timing histograms and rule counters of one guild."""
+
+    __slots__ = ('stages', 'triggers', 'actions')
+
+    def __init__(self):
+        self.stages = defaultdict(Histogram)
+        self.triggers = Counter()
+        self.actions = Counter()
+
+    @property
+    def total_time(self) -> float:
+        """Return time spent in `on_message`, in microseconds."""
+
+        total = self.stages.get('total')
+        return total.total if total else 0.0
+
+
+class StageTimer:
+    """Times consecutive stages of handling one message."""
+
+    __slots__ = ('stats', 'start', 'last')
+
+    def __init__(self, stats: GuildStats):
+        self.stats = stats
+        self.start = self.last = perf_counter()
+
+    def lap(self, stage: str):
+        """Record time since the previous lap as `stage`."""
+
+        now = perf_counter()
+        self.stats.stages[stage].add(now - self.last)
+        self.last = now
+
+    def finish(self):
+        self.stats.stages['total'].add(perf_counter() - self.start)
+
+
+def format_us(us: float) -> str:
+    """Return human readable duration from microseconds."""
+
+    if us < 1_000:
+        return f"{us:.0f}us"
+    if us < 1_000_000:
+        return f"{us / 1_000:.1f}ms"
+    return f"{us / 1_000_000:.1f}s"
+
+
+def format_stages(stats: GuildStats) -> str:
+    """Return table of stage timings."""
+
+    lines = [
+        f"{'Stage':<16}{'Count':>9}{'Mean':>9}{'p50':>9}{'p99':>9}{'Max':>9}"
+    ]
+    for stage, hist in sorted(
+        stats.stages.items(), key=lambda i: i[1].total, reverse=True
+    ):
+        lines.append(
+            f"{stage:<16}{hist.count:>9}{format_us(hist.mean):>9}"
+            f"{format_us(hist.percentile(50)):>9}"
+            f"{format_us(hist.percentile(99)):>9}{format_us(hist.max):>9}"
+        )
+    return "\n".join(lines)
+
+
+def format_counter(counter: Counter) -> str:
+    return ", ".join(f"{k}: {v}" for k, v in counter.most_common()) or "None"
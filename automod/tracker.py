@@ -0,0 +1,232 @@
+import re
+import sys
+from collections import Counter, OrderedDict, deque
+from typing import Any, Hashable, List, Optional, Tuple
+
+strip_regex = re.compile(r"[\W_]+")
+repeat_regex = re.compile(r"(.)\1+")
+
+
+class BaseTracker:
+    """Keyed record of recent activity, bounded in number of keys.
+
+    Keys are ``(guild_id, author_id)`` tuples, kept in order of their last
+    write. When more than `max_keys` keys are tracked, or the oldest key
+    wasn't written to for `max_idle` seconds, the oldest keys are evicted.
+    `max_idle` should be longer than any guild's automod duration.
+    """
+
+    def __init__(self, max_keys: int = 100_000, max_idle: float = 3600):
+        self.max_keys = max_keys
+        self.max_idle = max_idle
+        self.evicted = 0
+
+        # key -> entries of the key, least recently written key first
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def remove_guild(self, guild_id: int):
+        """Remove all entries of the guild."""
+
+        for key in [k for k in self._entries if k[0] == guild_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def size(self) -> Tuple[int, int]:
+        """Return number of tracked keys and entries."""
+
+        return len(self._entries), sum(
+            len(self._deque(data)) for data in self._entries.values()
+        )
+
+    def memory_usage(self) -> int:
+        """Return approximate memory used by the tracker, in bytes."""
+
+        total = sys.getsizeof(self._entries)
+        for key, data in self._entries.items():
+            total += _deep_sizeof(key) + _deep_sizeof(data)
+        return total
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+            self.evicted += 1
+
+        cutoff = now - self.max_idle
+        while entries:
+            key = next(iter(entries))
+            recent = self._deque(entries[key])
+            if recent and recent[-1][0] > cutoff:
+                break
+            del entries[key]
+            self.evicted += 1
+
+    @staticmethod
+    def _deque(data) -> deque:
+        return data
+
+
+def _deep_sizeof(obj) -> int:
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list, deque)):
+        size += sum(_deep_sizeof(item) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(
+            _deep_sizeof(k) + _deep_sizeof(v) for k, v in obj.items()
+        )
+    return size
+
+
+class SpamTracker(BaseTracker):
+    """Sliding-window record of recent messages, grouped by key.
+
+    Each key maps to a deque of ``(timestamp, value)`` pairs in arrival
+    order. Entries older than the window are pruned lazily whenever the
+    key is touched, so no task has to wait for an entry to expire.
+    """
+
+    def add(self, key: Hashable, value: Any, window: float, now: float):
+        """Record `value` for `key` at time `now`."""
+
+        entries = self._entries.get(key)
+        if entries is None:
+            self._entries[key] = deque([(now, value)])
+        else:
+            self._prune(entries, now - window)
+            entries.append((now, value))
+            self._entries.move_to_end(key)
+
+        self._evict(now)
+
+    def count(self, key: Hashable, window: float, now: float) -> int:
+        """Return number of entries of `key` within the last `window` seconds."""
+
+        entries = self._entries.get(key)
+        if entries is None:
+            return 0
+
+        self._prune(entries, now - window)
+        if not entries:
+            del self._entries[key]
+
+        return len(entries)
+
+    def pop(self, key: Hashable) -> List[Any]:
+        """Remove all entries of `key` and return their values."""
+
+        entries = self._entries.pop(key, ())
+        return [value for _, value in entries]
+
+    @staticmethod
+    def _prune(entries: deque, cutoff: float):
+        while entries and entries[0][0] <= cutoff:
+            entries.popleft()
+
+
+def fingerprint(content: str) -> Optional[int]:
+    """Return hash of normalized message content.
+
+    Case, whitespace, punctuation and repeated characters are ignored, so
+    small edits of the same text get the same fingerprint. Returns None if
+    nothing is left after normalization.
+    """
+
+    normalized = strip_regex.sub("", content.casefold())
+    normalized = repeat_regex.sub(r"\1", normalized)
+    if not normalized:
+        return None
+    return hash(normalized)
+
+
+class DuplicateTracker(BaseTracker):
+    """Sliding-window record of recent content fingerprints, grouped by key.
+
+    At most `maxlen` entries are kept per key, with a counter of each
+    fingerprint next to them, so recording and counting a message cost
+    O(1) amortized and memory per key is bounded.
+    """
+
+    def __init__(self, maxlen: int = 30, **kwargs):
+        super().__init__(**kwargs)
+        self.maxlen = maxlen
+
+    def add(
+        self,
+        key: Hashable,
+        fp: int,
+        value: Any,
+        window: float,
+        now: float
+    ):
+        """Record `value` with fingerprint `fp` for `key` at time `now`."""
+
+        try:
+            entries, counts = self._entries[key]
+        except KeyError:
+            entries, counts = self._entries[key] = (deque(), Counter())
+        else:
+            self._prune(entries, counts, now - window)
+            if len(entries) >= self.maxlen:
+                _, old_fp, _ = entries.popleft()
+                self._discount(counts, old_fp)
+            self._entries.move_to_end(key)
+
+        entries.append((now, fp, value))
+        counts[fp] += 1
+
+        self._evict(now)
+
+    def count(self, key: Hashable, fp: int, window: float, now: float) -> int:
+        """Return number of entries of `key` with fingerprint `fp` in window."""
+
+        try:
+            entries, counts = self._entries[key]
+        except KeyError:
+            return 0
+
+        self._prune(entries, counts, now - window)
+        if not entries:
+            del self._entries[key]
+            return 0
+
+        return counts[fp]
+
+    def pop(self, key: Hashable, fp: int) -> List[Any]:
+        """Remove entries of `key` with fingerprint `fp` and return their values."""
+
+        try:
+            entries, counts = self._entries[key]
+        except KeyError:
+            return []
+
+        values = [value for _, f, value in entries if f == fp]
+        kept = [entry for entry in entries if entry[1] != fp]
+        entries.clear()
+        entries.extend(kept)
+        counts.pop(fp, None)
+
+        if not entries:
+            del self._entries[key]
+
+        return values
+
+    def _prune(self, entries: deque, counts: Counter, cutoff: float):
+        while entries and entries[0][0] <= cutoff:
+            _, fp, _ = entries.popleft()
+            self._discount(counts, fp)
+
+    @staticmethod
+    def _deque(data) -> deque:
+        return data[0]
+
+    @staticmethod
+    def _discount(counts: Counter, fp: int):
+        if counts[fp] <= 1:
+            del counts[fp]
+        else:
+            counts[fp] -= 1
@@ -1,10 +1,42 @@
+import asyncio
+import time
+
+import discord
 from redbot.core import commands
+from redbot.core.bot import Red
 from redbot.core.i18n import Translator
 
 from .errors import LogNotSet
 
 _ = Translator("AutoMod", __file__)
 
+# core commands which change mod/admin roles of a guild
+ROLE_SETTING_COMMANDS = {
+    'set adminrole',
+    'set modrole',
+    'set addadminrole',
+    'set removeadminrole',
+    'set addmodrole',
+    'set removemodrole',
+}
+
+
+async def queue_get(queue: asyncio.Queue, timeout: float):
+    """Return next item of the queue, or None if none arrives in `timeout`.
+
+    `asyncio.wait_for` can swallow a cancellation which arrives just as
+    the item does, leaving the caller running after it was cancelled.
+    """
+
+    getter = asyncio.ensure_future(queue.get())
+    try:
+        await asyncio.wait((getter,), timeout=timeout)
+    finally:
+        if not getter.done():
+            getter.cancel()
+
+    return getter.result() if getter.done() and not getter.cancelled() else None
+
 
 def is_log_set():
     """A decorator to check if log channel is set."""
@@ -24,3 +56,61 @@ def is_log_set():
         return True
 
     return commands.check(predicate)
+
+
+class ModRoleCache:
+    """Cache of mod and admin role ids of each guild.
+
+    A cheaper stand-in for `redbot.core.utils.mod.is_mod_or_superior`
+    on hot paths. Entries also expire after `ttl` seconds, in case
+    roles are changed in a way the cog isn't told about.
+
+    Same as the class of the same name in the ExtMod cog. Cogs are
+    installed separately, so neither can import the other.
+    """
+
+    def __init__(self, bot: Red, ttl: float = 300):
+        self.bot = bot
+        self.ttl = ttl
+        # guild id -> (expiry, frozenset of role ids)
+        self._roles = {}
+
+    async def is_mod_or_superior(self, user: discord.abc.User) -> bool:
+        """Return True if user is a bot owner, mod or admin."""
+
+        if await self.bot.is_owner(user):
+            return True
+
+        if not isinstance(user, discord.Member):
+            return False
+
+        roles = await self.get_role_ids(user.guild)
+        return bool(roles) and not roles.isdisjoint(
+            role.id for role in user.roles
+        )
+
+    async def get_role_ids(self, guild: discord.Guild) -> frozenset:
+        """Return ids of mod and admin roles of the guild."""
+
+        try:
+            expiry, roles = self._roles[guild.id]
+        except KeyError:
+            pass
+        else:
+            if expiry > time.monotonic():
+                return roles
+
+        admin_roles = await self.bot.get_admin_role_ids(guild.id)
+        mod_roles = await self.bot.get_mod_role_ids(guild.id)
+        roles = frozenset(admin_roles) | frozenset(mod_roles)
+
+        self._roles[guild.id] = (time.monotonic() + self.ttl, roles)
+        return roles
+
+    def invalidate(self, guild_id: int = None):
+        """Drop cached roles of the guild, or of all guilds."""
+
+        if guild_id is None:
+            self._roles.clear()
+        else:
+            self._roles.pop(guild_id, None)
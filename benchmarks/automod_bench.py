@@ -0,0 +1,332 @@
+"""Drive `AutoMod.on_message` with synthetic traffic and report its cost.
+
+Run from the repository root, with Red installed::
+
+    python -m benchmarks.automod_bench --scenario all --messages 20000
+
+Streams are generated from `--seed`, so runs with the same arguments
+replay the same traffic. A stream can be written to a JSONL file with
+`--save` and replayed with `--load`. Config and the bot are replaced with
+the fakes in `benchmarks.fakes`, so no REST call leaves the process.
+
+With `--scan-processes`, large message filters are searched in a scan
+pool, and `--concurrency` messages are handled at once so the workers
+can search in parallel.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import random
+import string
+import time
+import tracemalloc
+from typing import Optional
+from unittest import mock
+
+from automod import automod as automod_module
+from automod.automod import AutoMod, default_guild
+
+from . import fakes
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog hello there how are you doing"
+    " today game stream server voice chat meme lol ok nice thanks good night"
+).split()
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def chat_line(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15)))
+
+
+def record(rng, args, author=None, content=None, attachments=0, mentions=0):
+    return {
+        'guild': rng.randrange(args.guilds),
+        'channel': rng.randrange(args.channels),
+        'author': rng.randrange(args.authors) if author is None else author,
+        'content': chat_line(rng) if content is None else content,
+        'attachments': attachments,
+        'mentions': mentions,
+    }
+
+
+@scenario('chat')
+def chat_stream(rng, args):
+    for _ in range(args.messages):
+        yield record(rng, args)
+
+
+@scenario('mentions')
+def mention_stream(rng, args):
+    for _ in range(args.messages):
+        if rng.random() < 0.1:
+            yield record(rng, args, mentions=rng.randint(10, 30))
+        else:
+            yield record(rng, args)
+
+
+@scenario('attachments')
+def attachment_stream(rng, args):
+    spammers = rng.sample(range(args.authors), 20)
+    for _ in range(args.messages):
+        if rng.random() < 0.3:
+            yield record(
+                rng, args, author=rng.choice(spammers),
+                attachments=rng.randint(1, 4)
+            )
+        else:
+            yield record(rng, args)
+
+
+@scenario('duplicates')
+def duplicate_stream(rng, args):
+    spammers = rng.sample(range(args.authors), 20)
+    pastes = [chat_line(rng) for _ in range(5)]
+    for _ in range(args.messages):
+        if rng.random() < 0.3:
+            yield record(
+                rng, args, author=rng.choice(spammers),
+                content=rng.choice(pastes)
+            )
+        else:
+            yield record(rng, args)
+
+
+@scenario('invites')
+def invite_stream(rng, args):
+    codes = [
+        "".join(rng.choices(string.ascii_letters, k=8)) for _ in range(50)
+    ]
+    for _ in range(args.messages):
+        roll = rng.random()
+        if roll < 0.15:
+            content = f"join discord.gg/{rng.choice(codes)} now"
+            yield record(rng, args, content=content)
+        elif roll < 0.3:
+            # invites to the server the message is posted in
+            r = record(rng, args)
+            code = fakes.own_invite(r['guild'] + 1, rng.randrange(3))
+            r['content'] = f"come back to discord.gg/{code}"
+            yield r
+        else:
+            yield record(rng, args)
+
+
+@scenario('filter')
+def filter_stream(rng, args):
+    return chat_stream(rng, args)
+
+
+@scenario('keywords')
+def keyword_stream(rng, args):
+    return chat_stream(rng, args)
+
+
+def make_filter(rng: random.Random, size: int, literal: bool = False) -> list:
+    patterns = []
+    for i in range(size):
+        word = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 9)))
+        if literal:
+            patterns.append(word if i % 2 else f"{word} {rng.choice(WORDS)}")
+        elif i % 4 == 0:
+            patterns.append(rf"{word[:3]}\w*{word[3:]}")
+        elif i % 4 == 1:
+            patterns.append(rf"\b{word}s?\b")
+        else:
+            patterns.append(word)
+    return patterns
+
+
+def make_settings(name: str, rng: random.Random, args) -> dict:
+    settings = copy.deepcopy(default_guild)
+    settings['automod_duration'] = 5
+    for event, limit in (
+        ('mention_spam', 8), ('message_spam', 6), ('attachment_spam', 4),
+        ('duplicate_spam', 3)
+    ):
+        settings[event].update(enabled=True, limit=limit, mute=False)
+
+    settings['filter_invites']['enabled'] = True
+    settings['filter_messages']['enabled'] = True
+
+    size = args.filter_size if name in ('filter', 'keywords') else 50
+    settings['filter_messages']['filter'] = make_filter(
+        rng, size, literal=name == 'keywords'
+    )
+    return settings
+
+
+async def run(records: list, settings: dict, args, trace: bool = False):
+    """Feed records to a fresh cog and return per-message latencies."""
+
+    guilds = [
+        fakes.FakeGuild(i + 1, channels=args.channels, members=args.authors)
+        for i in range(args.guilds)
+    ]
+
+    guild_settings = {}
+    for guild in guilds:
+        guild_settings[guild.id] = copy.deepcopy(settings)
+        guild_settings[guild.id]['log_channel'] = guild.log_channel.id
+
+    config = fakes.FakeConfig(guild_settings)
+    with mock.patch.object(
+        automod_module.Config, 'get_conf', return_value=config
+    ):
+        cog = AutoMod(fakes.FakeBot(guilds=guilds))
+    await cog.initialize()
+    # filter patterns are searched once they pass the probe
+    await asyncio.gather(*cog.probe_tasks.values())
+    if args.scan_processes:
+        await cog.start_scan_pool(args.scan_processes)
+
+    messages = []
+    for r in records:
+        guild = guilds[r['guild'] % len(guilds)]
+        messages.append(fakes.FakeMessage(
+            guild,
+            guild.channels[r['channel'] % len(guild.channels)],
+            guild.members[r['author'] % len(guild.members)],
+            r['content'],
+            attachments=r['attachments'],
+            mentions=r['mentions']
+        ))
+
+    if trace:
+        tracemalloc.start()
+
+    latencies = []
+    on_message = cog.on_message
+    perf_counter = time.perf_counter
+
+    async def timed(message):
+        start = perf_counter()
+        await on_message(message)
+        latencies.append(perf_counter() - start)
+
+    started = perf_counter()
+    if args.concurrency > 1:
+        for i in range(0, len(messages), args.concurrency):
+            await asyncio.gather(
+                *map(timed, messages[i:i + args.concurrency])
+            )
+    else:
+        for message in messages:
+            await timed(message)
+    elapsed = perf_counter() - started
+
+    # actions run after on_message returns, wait for them before counting
+    await cog.executor.join()
+
+    peak = None
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    cog.cog_unload()
+    # let cancelled background tasks finish
+    await asyncio.sleep(0)
+    return latencies, peak, elapsed
+
+
+def percentile(values: list, pct: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(
+    name: str, latencies: list, elapsed: float, peak: Optional[int],
+    calls: dict
+):
+    latencies = sorted(latencies)
+    us = 1_000_000
+    peak = "n/a" if peak is None else f"{peak / 2 ** 20:.2f}MiB"
+    rest = ", ".join(f"{k}={v}" for k, v in sorted(calls.items())) or "none"
+    print(
+        f"{name:<12} {len(latencies):>8} msgs {len(latencies) / elapsed:>10.0f} msg/s"
+        f"  p50 {percentile(latencies, 50) * us:>7.1f}us"
+        f"  p90 {percentile(latencies, 90) * us:>7.1f}us"
+        f"  p99 {percentile(latencies, 99) * us:>7.1f}us"
+        f"  max {latencies[-1] * us:>8.1f}us"
+        f"  peak {peak:>9}"
+        f"  rest: {rest}"
+    )
+
+
+def load(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save(path: str, records: list):
+    with open(path, 'w') as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+
+
+async def main(args):
+    names = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+
+    for name in names:
+        rng = random.Random(args.seed)
+        settings = make_settings(name, rng, args)
+        if args.load:
+            records = load(args.load)
+        else:
+            records = list(SCENARIOS[name](rng, args))
+        if args.save:
+            save(args.save, records)
+
+        fakes.calls.clear()
+        latencies, _, elapsed = await run(records, settings, args)
+        calls = dict(fakes.calls)
+
+        peak = None
+        if not args.no_memory:
+            _, peak, _ = await run(records, settings, args, trace=True)
+
+        report(name, latencies, elapsed, peak, calls)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        '--scenario', default='all', choices=['all', *SCENARIOS]
+    )
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--authors', type=int, default=2_000)
+    parser.add_argument('--filter-size', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help="write the stream to a JSONL file")
+    parser.add_argument('--load', help="replay a stream from a JSONL file")
+    parser.add_argument(
+        '--scan-processes', type=int, default=0,
+        help="search large filters in a scan pool of this many processes"
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=1,
+        help="messages handled at once"
+    )
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help="skip the traced run that measures peak memory"
+    )
+    args = parser.parse_args(argv)
+    if args.save and args.scenario == 'all':
+        parser.error("--save needs a single --scenario")
+    return args
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
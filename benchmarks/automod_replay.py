@@ -0,0 +1,299 @@
+"""Replay exported chat logs through the automod rules, offline.
+
+Run from the repository root, with Red installed::
+
+    python -m benchmarks.automod_replay export.jsonl --settings guild.json \\
+        --limit message_spam=6 --duration 5 --output flagged.jsonl
+
+Each line of the export is a JSON object with `guild`, `channel`, `author`,
+`timestamp` (epoch seconds or ISO 8601), `content`, and optionally `id`,
+`attachments` and `mentions` (counts). Lines must be in time order.
+Messages without an `id` are given their line number in the export.
+
+Messages are routed to worker processes by guild, so every process owns
+the whole spam state of its guilds, and go through the same rule plan as
+`AutoMod.on_message`. Nothing is deleted, muted or logged. Invites can't
+be resolved offline, so every invite link counts as unknown and is
+flagged unless the invite rule is disabled. Filter patterns are probed
+once before the replay, and ones too slow to search are left out.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+from unittest import mock
+
+from automod import automod as automod_module
+from automod.automod import AutoMod, default_guild
+from automod.events import SPAM_EVENTS
+from automod.keywords import is_literal
+from automod.matcher import probe_patterns
+from automod.rules import RuleContext
+from automod.stats import GuildStats, StageTimer
+
+from . import fakes
+
+BATCH_SIZE = 2_000
+
+guild_regex = re.compile(r'"guild"\s*:\s*"?(\d+)')
+
+
+class OfflineBot(fakes.FakeBot):
+    async def fetch_invite(self, code: str):
+        return None
+
+
+def parse_timestamp(value) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def make_message(record: dict, guilds: dict, line_no: int) -> SimpleNamespace:
+    guild_id = int(record['guild'])
+    guild = guilds.get(guild_id)
+    if guild is None:
+        guild = guilds[guild_id] = SimpleNamespace(id=guild_id)
+
+    return SimpleNamespace(
+        id=int(record.get('id') or line_no),
+        guild=guild,
+        channel=SimpleNamespace(id=int(record['channel'])),
+        author=SimpleNamespace(id=int(record['author'])),
+        content=record.get('content') or "",
+        attachments=[None] * record.get('attachments', 0),
+        raw_mentions=[0] * record.get('mentions', 0),
+        raw_role_mentions=[],
+    )
+
+
+async def replay(queue, settings: dict, output: Optional[str]):
+    """Run batches of `(line number, raw line)` from `queue` through the rules."""
+
+    config = fakes.FakeConfig({})
+    with mock.patch.object(
+        automod_module.Config, 'get_conf', return_value=config
+    ):
+        cog = AutoMod(OfflineBot())
+
+    stats = GuildStats()
+    hits = Counter()
+    guilds = {}
+    out = open(output, 'w') if output else None
+
+    try:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+
+            for line_no, line in batch:
+                record = json.loads(line)
+                message = make_message(record, guilds, line_no)
+                guild_id = message.guild.id
+                if guild_id not in cog.settings_cache:
+                    cog.cache_settings(guild_id, copy.deepcopy(settings))
+
+                state = RuleContext(
+                    message,
+                    cog.settings_cache[guild_id],
+                    parse_timestamp(record['timestamp'])
+                )
+                event = await cog.run_rules(state, StageTimer(stats))
+                if event:
+                    hits[event] += 1
+                    plan = cog.plan_action(
+                        event, message, state.settings,
+                        state.invite, state.match, state.fp
+                    )
+                    if out:
+                        out.write(json.dumps({
+                            'guild': guild_id,
+                            'channel': message.channel.id,
+                            'author': message.author.id,
+                            'id': message.id,
+                            'timestamp': record['timestamp'],
+                            'rule': event,
+                            'messages': [m for _, m in plan.msg_refs],
+                            'detail': (
+                                plan.match.pattern if plan.match
+                                else state.invite
+                            ),
+                        }) + "\n")
+                cog.track_message(state)
+    finally:
+        if out:
+            out.close()
+        cog.cog_unload()
+
+    timings = {
+        stage: (hist.count, hist.total)
+        for stage, hist in stats.stages.items()
+    }
+    return hits, timings
+
+
+def worker(queue, results, settings: dict, output: Optional[str]):
+    results.put(asyncio.run(replay(queue, settings, output)))
+
+
+def load_settings(args) -> dict:
+    settings = copy.deepcopy(default_guild)
+    if args.settings:
+        with open(args.settings) as f:
+            for key, value in json.load(f).items():
+                if isinstance(value, dict) and key in settings:
+                    settings[key].update(value)
+                else:
+                    settings[key] = value
+
+    if args.duration is not None:
+        settings['automod_duration'] = args.duration
+    for item in args.limit:
+        event, _, limit = item.partition('=')
+        settings[event].update(enabled=True, limit=int(limit))
+    if args.filter_file:
+        with open(args.filter_file) as f:
+            settings['filter_messages'].update(
+                enabled=True, filter=[p for p in f.read().splitlines() if p]
+            )
+
+    # every rule is evaluated as if enforced
+    settings['shadow'] = []
+    return settings
+
+
+def probe_filter(settings: dict):
+    """Probe regex patterns of the filter, as the cog does before searching.
+
+    Done once here rather than in every worker. Patterns which fail are
+    quarantined, the rest are marked as probed.
+    """
+
+    filter_settings = settings['filter_messages']
+    quarantine = filter_settings['quarantine']
+    probed = filter_settings['probed']
+    slow = asyncio.run(probe_patterns(
+        p for p in filter_settings['filter']
+        if p not in quarantine and p not in probed and not is_literal(p)
+    ))
+    for pattern in slow:
+        print(f"Quarantined filter pattern {pattern!r}, it's too slow.")
+    quarantine.extend(slow)
+    AutoMod.save_probed(filter_settings, [
+        p for p in filter_settings['filter'] if p not in quarantine
+    ])
+
+
+def main(args):
+    settings = load_settings(args)
+    probe_filter(settings)
+    procs = args.processes or os.cpu_count() or 1
+
+    queues = [multiprocessing.Queue(maxsize=64) for _ in range(procs)]
+    results = multiprocessing.Queue()
+    parts = [f"{args.output}.part{i}" if args.output else None
+             for i in range(procs)]
+    workers = [
+        multiprocessing.Process(
+            target=worker, args=(queue, results, settings, part)
+        )
+        for queue, part in zip(queues, parts)
+    ]
+    for p in workers:
+        p.start()
+
+    start = time.perf_counter()
+    total = 0
+    batches = [[] for _ in range(procs)]
+    with open(args.export) as f:
+        for line_no, line in enumerate(f, 1):
+            match = guild_regex.search(line)
+            if not match:
+                continue
+            i = int(match.group(1)) % procs
+            batch = batches[i]
+            batch.append((line_no, line))
+            if len(batch) >= BATCH_SIZE:
+                queues[i].put(batch)
+                batches[i] = []
+            total += 1
+
+    for queue, batch in zip(queues, batches):
+        if batch:
+            queue.put(batch)
+        queue.put(None)
+
+    hits = Counter()
+    timings = Counter()
+    counts = Counter()
+    for _ in workers:
+        worker_hits, worker_timings = results.get()
+        hits.update(worker_hits)
+        for stage, (count, total_us) in worker_timings.items():
+            counts[stage] += count
+            timings[stage] += total_us
+    for p in workers:
+        p.join()
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            for part in parts:
+                with open(part) as f:
+                    shutil.copyfileobj(f, out)
+                os.remove(part)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{total} messages in {elapsed:.1f}s ({total / elapsed:.0f} msg/s)"
+        f" on {procs} processes"
+    )
+    print(f"{'Rule':<18}{'Hits':>10}{'Checked':>12}{'Mean':>10}")
+    for stage in sorted(counts, key=lambda s: -hits[s]):
+        mean = timings[stage] / counts[stage] if counts[stage] else 0
+        print(
+            f"{stage:<18}{hits[stage]:>10}{counts[stage]:>12}"
+            f"{mean:>8.1f}us"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('export', help="JSONL file of exported messages")
+    parser.add_argument(
+        '--settings', help="JSON file of guild settings, as in Config"
+    )
+    parser.add_argument(
+        '--limit', action='append', default=[], metavar='EVENT=LIMIT',
+        help="enable a spam rule with the limit, can be repeated"
+    )
+    parser.add_argument('--duration', type=int, help="automod duration")
+    parser.add_argument(
+        '--filter-file', help="file of filter patterns, one per line"
+    )
+    parser.add_argument(
+        '--output', help="write flagged messages to a JSONL file"
+    )
+    parser.add_argument(
+        '--processes', type=int, help="worker processes, default CPU count"
+    )
+    args = parser.parse_args(argv)
+    for item in args.limit:
+        event, _, limit = item.partition('=')
+        if event not in SPAM_EVENTS or not limit.isdigit():
+            parser.error(f"invalid --limit {item}")
+    return args
+
+
+if __name__ == '__main__':
+    main(parse_args())
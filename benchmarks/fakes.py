@@ -0,0 +1,258 @@
+"""Lightweight stand-ins for the discord.py and Red objects AutoMod uses.
+
+Only the attributes and coroutines touched by `AutoMod.on_message` are
+provided. REST calls are counted instead of made.
+"""
+
+import asyncio
+import copy
+import itertools
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+
+import discord
+
+ADMIN_ROLE_ID = 1
+MOD_ROLE_ID = 2
+
+# snowflakes are generated from the current time so the bulk delete age
+# check treats synthetic messages as recent
+_snowflakes = itertools.count(discord.utils.time_snowflake(datetime.utcnow()))
+
+calls = Counter()
+
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+
+class FakeConfig:
+    """Config replacement backed by a dict of guild settings."""
+
+    def __init__(self, guild_settings: dict):
+        self.guild_settings = guild_settings
+        self.global_settings = {}
+
+    def register_global(self, **defaults):
+        self.global_settings.update(defaults)
+
+    def register_guild(self, **defaults):
+        pass
+
+    def register_member(self, **defaults):
+        pass
+
+    async def all_guilds(self):
+        return copy.deepcopy(self.guild_settings)
+
+    def guild(self, guild):
+        return _FakeGroup(self.guild_settings[guild.id])
+
+    def __getattr__(self, name):
+        if name not in self.__dict__.get('global_settings', {}):
+            raise AttributeError(name)
+        return _FakeValue(self.global_settings, name)
+
+
+class _FakeValue:
+    def __init__(self, data: dict, key: str):
+        self.data = data
+        self.key = key
+
+    def __call__(self):
+        return _FakeValueContext(self.data[self.key])
+
+    async def set(self, value):
+        self.data[self.key] = value
+
+
+class _FakeValueContext:
+    """Awaitable value which can also be edited in `async with`."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        async def get():
+            return self.value
+        return get().__await__()
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class _FakeGroup:
+    def __init__(self, data: dict):
+        self.data = data
+
+    async def all(self):
+        return copy.deepcopy(self.data)
+
+    def __getattr__(self, name):
+        if name not in self.__dict__.get('data', {}):
+            raise AttributeError(name)
+        return _FakeValue(self.data, name)
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class FakeMember:
+    def __init__(self, member_id: int, guild: "FakeGuild", roles=()):
+        self.id = member_id
+        self.guild = guild
+        self.roles = list(roles)
+        self.name = f"user{member_id}"
+        self.display_name = self.name
+        self.avatar_url = ""
+        self.mention = f"<@{member_id}>"
+
+    def __str__(self):
+        return f"{self.name}#0001"
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: "FakeGuild"):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel{channel_id}"
+        self.mention = f"<#{channel_id}>"
+
+    async def send(self, *args, **kwargs):
+        calls['send'] += 1
+
+    async def delete_messages(self, messages):
+        calls['delete_messages'] += 1
+
+    async def set_permissions(self, *args, **kwargs):
+        calls['set_permissions'] += 1
+
+    def permissions_for(self, member):
+        return SimpleNamespace(manage_webhooks=True)
+
+    async def webhooks(self):
+        calls['webhooks'] += 1
+        return []
+
+    async def create_webhook(self, name: str):
+        calls['create_webhook'] += 1
+        return FakeWebhook(name)
+
+
+class FakeWebhook:
+    def __init__(self, name: str):
+        self.name = name
+        self.token = "token"
+
+    async def send(self, *args, **kwargs):
+        calls['webhook_send'] += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, channels: int = 10, members: int = 1000):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self.me = FakeMember(snowflake(), self)
+        self.me.guild_permissions = SimpleNamespace(manage_guild=True)
+        self.vanity_url_code = None
+        self.channels = [FakeChannel(snowflake(), self) for _ in range(channels)]
+        self.log_channel = FakeChannel(snowflake(), self)
+        self.members = [
+            FakeMember(snowflake(), self, [FakeRole(snowflake())])
+            for _ in range(members)
+        ]
+        self._channels = {c.id: c for c in self.channels}
+        self._channels[self.log_channel.id] = self.log_channel
+
+    def get_channel(self, channel_id: int):
+        return self._channels.get(channel_id)
+
+    async def invites(self):
+        calls['invites'] += 1
+        return [FakeInvite(own_invite(self.id, i), self.id) for i in range(3)]
+
+
+def own_invite(guild_id: int, number: int = 0) -> str:
+    """Return code of one of the guild's own invites."""
+
+    return f"own{guild_id}x{number}"
+
+
+class FakeAttachment:
+    def __init__(self, filename: str):
+        self.filename = filename
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        guild: FakeGuild,
+        channel: FakeChannel,
+        author: FakeMember,
+        content: str,
+        attachments: int = 0,
+        mentions: int = 0
+    ):
+        self.id = snowflake()
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.attachments = [
+            FakeAttachment(f"file{i}.png") for i in range(attachments)
+        ]
+        self.raw_mentions = [m.id for m in guild.members[:mentions]]
+        self.raw_role_mentions = []
+        self.created_at = datetime.utcnow()
+
+    async def delete(self):
+        calls['delete'] += 1
+
+
+class FakeInviteGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+
+
+class FakeInvite:
+    def __init__(self, code: str, guild_id: int):
+        self.code = code
+        self.guild = FakeInviteGuild(guild_id)
+
+
+class FakeBot:
+    """Bot replacement answering the calls AutoMod makes on the hot path."""
+
+    def __init__(self, latency: float = 0, guilds=()):
+        self.latency = latency
+        self.guilds = {guild.id: guild for guild in guilds}
+
+    def get_guild(self, guild_id: int):
+        return self.guilds.get(guild_id)
+
+    def get_command(self, name: str):
+        return None
+
+    async def is_owner(self, user) -> bool:
+        return False
+
+    async def get_admin_role_ids(self, guild_id: int):
+        return [ADMIN_ROLE_ID]
+
+    async def get_mod_role_ids(self, guild_id: int):
+        return [MOD_ROLE_ID]
+
+    async def fetch_invite(self, code: str):
+        calls['fetch_invite'] += 1
+        await asyncio.sleep(self.latency)
+        guild_id = 0
+        if code.startswith("own"):
+            guild_id = int(code[3:].split("x")[0])
+        return FakeInvite(code, guild_id)
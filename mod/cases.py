@@ -0,0 +1,52 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class CaseIndex:
+    """Case numbers and action types of a guild's modlog cases.
+
+    The latest case number and the cases of each member are loaded on
+    first use and kept current as cases are created afterwards, so
+    looking them up doesn't scan the modlog again.
+    """
+
+    def __init__(self, latest: int = 0):
+        self.latest = latest
+        # member id -> {case number: action type}
+        self._members: Dict[int, Dict[int, str]] = {}
+        # (member id, action type) -> latest case number
+        self._latest_of: Dict[Tuple[int, str], int] = {}
+
+    def has_member(self, member_id: int) -> bool:
+        return member_id in self._members
+
+    def load_member(self, member_id: int, cases: Iterable[Tuple[int, str]]):
+        """Set the `(case number, action type)` of all cases of a member."""
+
+        self._members[member_id] = {}
+        for case_number, action_type in cases:
+            self._add_member_case(member_id, case_number, action_type)
+
+    def add(self, case_number: int, member_id: int, action_type: str):
+        """Add a new case. Cases of members not loaded yet are skipped."""
+
+        if case_number > self.latest:
+            self.latest = case_number
+        if member_id in self._members:
+            self._add_member_case(member_id, case_number, action_type)
+
+    def _add_member_case(self, member_id: int, case_number: int, action_type: str):
+        self._members[member_id][case_number] = action_type
+
+        key = (member_id, action_type)
+        if case_number > self._latest_of.get(key, 0):
+            self._latest_of[key] = case_number
+
+    def cases_of(self, member_id: int) -> Dict[int, str]:
+        """Return `{case number: action type}` of a member, oldest first."""
+
+        return dict(sorted(self._members.get(member_id, {}).items()))
+
+    def latest_of(self, member_id: int, action_type: str) -> Optional[int]:
+        """Return number of the member's latest case of a type, if any."""
+
+        return self._latest_of.get((member_id, action_type))
@@ -3,6 +3,7 @@ import json
 import logging
 import os
 import re
+import time
 
 from collections import namedtuple
 from datetime import datetime, timedelta
@@ -27,6 +28,10 @@ from redbot.core.utils.mod import (
     )
 from redbot.core.utils.predicates import ReactionPredicate
 
+from .cases import CaseIndex
+from .roles import ROLE_SETTING_COMMANDS, ModRoleCache
+from .scheduler import ExpiryScheduler
+
 
 log = logging.getLogger("red.extmod")
 
@@ -91,6 +96,14 @@ ROLE_USER_HIERARCHY_ISSUE = _(
 
 NEED_MANAGE_ROLES = _("I need manage roles permission to do that.")
 
+# core commands which delete all modlog cases of a guild
+CASE_RESET_COMMANDS = {"modlogset resetcases"}
+
+# seconds before a failed automatic unmute is tried again
+UNMUTE_RETRY_DELAY = 60
+
+Member = namedtuple("Member", "id guild")
+
 # This makes sure the cog name is "Mod" for help still.
 @cog_i18n(_)
 class ExtMod(Mod, name='Mod'):
@@ -103,6 +116,14 @@ class ExtMod(Mod, name='Mod'):
         self.config.register_guild(**default_guild)
         self.config.register_member(**default_member)
 
+        self.mod_roles = ModRoleCache(self.bot)
+        # guild id -> {channel id: seconds} of channels with custom slowmode
+        self.uslowmode_cache = {}
+        # guild id -> CaseIndex of its modlog cases
+        self.case_index = {}
+        # casetype name -> case string
+        self.casetype_names = {}
+
         def error_callback(fut):
             try:
                 fut.result()
@@ -111,8 +132,14 @@ class ExtMod(Mod, name='Mod'):
             except Exception as exc:
                 logging.exception("Error in something", exc_info=exc)
 
-        self.tmute_expiry_task = self.bot.loop.create_task(self.check_tempmute_expirations())
-        self.uslow_expiry_task = self.bot.loop.create_task(self.check_uslow_expirations())
+        # (guild id, member id) -> automatic unmute at `muted_until`
+        self.tempmutes = ExpiryScheduler(self.expire_tempmute)
+
+        # (channel id, member id) -> end of the member's custom slowmode
+        self.uslow_locks = ExpiryScheduler(self.expire_uslow)
+
+        self.tmute_expiry_task = self.bot.loop.create_task(self.load_tempmutes())
+        self.uslow_expiry_task = self.bot.loop.create_task(self.load_uslow_locks())
         self.tmute_expiry_task.add_done_callback(error_callback)
         self.uslow_expiry_task.add_done_callback(error_callback)
 
@@ -375,6 +402,9 @@ class ExtMod(Mod, name='Mod'):
         async with self.config.member(user).sticky_roles() as sticky_roles:
             sticky_roles.remove(mute_role_id)
 
+        if self.tempmutes.cancel((ctx.guild.id, user.id)):
+            await self._clear_tempmute(ctx.guild, user.id)
+
         await ctx.send(f"Unmuted **{user}**.")
 
         try:
@@ -716,6 +746,13 @@ class ExtMod(Mod, name='Mod'):
 
         async with self.config.guild(ctx.guild).uslowmodes() as uslowmodes:
             uslowmodes[channel.id] = seconds
+
+        cached = self.uslowmode_cache.get(ctx.guild.id)
+        if cached is not None:
+            if seconds:
+                cached[channel.id] = seconds
+            else:
+                cached.pop(channel.id, None)
         
         if seconds:
             await ctx.send(f"Set a custom slowmode {self.get_time(duration, ret_str=True)}"
@@ -772,7 +809,7 @@ class ExtMod(Mod, name='Mod'):
                 "of messages".format(author.name, author.id, user.name, user.id)
             )
             try:
-                await modlog.create_case(
+                case = await modlog.create_case(
                     self.bot,
                     guild,
                     ctx.message.created_at,
@@ -784,9 +821,10 @@ class ExtMod(Mod, name='Mod'):
                     channel=None,
                 )
             except RuntimeError as e:
+                case = None
                 await ctx.send(e)
 
-            case_number = await self.get_case_number(guild)
+            case_number = case.case_number if case else await self.get_case_number(guild)
 
             await ctx.send(_(f"Softbanned **{user.name}**. (Case number {case_number})"))
   
@@ -826,7 +864,7 @@ class ExtMod(Mod, name='Mod'):
             return
         else:
             try:
-                await modlog.create_case(
+                case = await modlog.create_case(
                     self.bot,
                     guild,
                     ctx.message.created_at,
@@ -838,9 +876,10 @@ class ExtMod(Mod, name='Mod'):
                     channel=None,
                 )
             except RuntimeError as e:
+                case = None
                 await ctx.send(e)
             
-            case_number = await self.get_case_number(guild)
+            case_number = case.case_number if case else await self.get_case_number(guild)
 
             await ctx.send(_(f"Unbanned **{user}** from the server. (Case number {case_number})"))
 
@@ -1017,7 +1056,7 @@ class ExtMod(Mod, name='Mod'):
             await ctx.send(_("Something went wrong while banning"))
         else:
             try:
-                await modlog.create_case(
+                case = await modlog.create_case(
                     self.bot,
                     guild,
                     ctx.message.created_at,
@@ -1028,13 +1067,14 @@ class ExtMod(Mod, name='Mod'):
                     unban_time,
                 )
             except RuntimeError as e:
+                case = None
                 await ctx.send(e)
 
             day_str = f"{days} day"
             if days >= 1:
                 day_str += "s"
 
-            case_number = await self.get_case_number(guild)
+            case_number = case.case_number if case else await self.get_case_number(guild)
 
             await ctx.send(_(f"Banned **{user}** for {day_str}. (Case number {case_number})"))
 
@@ -1213,7 +1253,7 @@ class ExtMod(Mod, name='Mod'):
             log.exception(e)
         else:
             try:
-                await modlog.create_case(
+                case = await modlog.create_case(
                     self.bot,
                     guild,
                     ctx.message.created_at,
@@ -1225,9 +1265,10 @@ class ExtMod(Mod, name='Mod'):
                     channel=None,
                 )
             except RuntimeError as e:
+                case = None
                 await ctx.send(e)
                 
-            case_number = await self.get_case_number(guild)
+            case_number = case.case_number if case else await self.get_case_number(guild)
             
             await ctx.send(_(f"Kicked **{user}** from the server. (Case number {case_number})"))
     
@@ -1556,28 +1597,31 @@ class ExtMod(Mod, name='Mod'):
         author = message.author
         channel = message.channel
 
-        leave = False
-        
-        is_mod = await is_mod_or_superior(bot=self.bot, obj=message)
-        if  is_mod:
-            leave = True
-
-        if author == self.bot.user:
-            leave = True
+        if not message.guild:
+            return
 
-        if not leave:
-            Member = namedtuple("Member", "id guild")
+        uslowmodes = self.uslowmode_cache.get(message.guild.id)
+        if uslowmodes is None:
+            uslowmodes = await self.get_uslowmodes(message.guild)
 
-            async with self.config.guild(message.guild).uslowmodes() as uslowmodes:
-                if str(channel.id) in uslowmodes.keys():
-                    if uslowmodes[str(channel.id)]:
-                        await channel.set_permissions(author, send_messages=False, add_reactions=False)
+        duration = uslowmodes.get(channel.id)
+        if not duration:
+            return
 
-                    async with self.config.member(author).current_slowmodes() as slowmodes:
-                        
-                        timestamp = self.utc_timestamp(datetime.utcnow())
+        if author == self.bot.user:
+            return
+        if (channel.id, author.id) in self.uslow_locks:
+            # already locked
+            return
+        if await self.mod_roles.is_mod_or_superior(author):
+            return
 
-                        slowmodes[channel.id] = timestamp
+        timestamp = self.utc_timestamp(datetime.utcnow())
+        self.uslow_locks.schedule((channel.id, author.id), timestamp + duration)
+        await channel.set_permissions(author, send_messages=False, add_reactions=False)
+        await self.config.member(author).current_slowmodes.set_raw(
+            str(channel.id), value=timestamp
+        )
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
@@ -1614,30 +1658,47 @@ class ExtMod(Mod, name='Mod'):
                     # sticky_roles.remove(560444582429589504)
                     sticky_roles[:] = [i for i in sticky_roles if i != sticky_role_id]
 
+    @commands.Cog.listener("on_command_completion")
+    async def _reset_mod_roles_on_command(self, ctx: commands.Context):
+        if ctx.guild and ctx.command.qualified_name in ROLE_SETTING_COMMANDS:
+            self.mod_roles.invalidate(ctx.guild.id)
+
+    @commands.Cog.listener("on_command_completion")
+    async def _reset_case_index_on_command(self, ctx: commands.Context):
+        if ctx.guild and ctx.command.qualified_name in CASE_RESET_COMMANDS:
+            self.case_index.pop(ctx.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_modlog_case_create(self, case: Case):
+        # cases of this and every other cog
+        self.index_case(case)
+
+    @commands.Cog.listener("on_guild_role_delete")
+    async def _reset_mod_roles_on_role_delete(self, role: discord.Role):
+        self.mod_roles.invalidate(role.guild.id)
+
+    async def get_uslowmodes(self, guild: discord.Guild) -> dict:
+        """Return `{channel id: seconds}` of channels with custom slowmode."""
+
+        uslowmodes = await self.config.guild(guild).uslowmodes()
+        cached = self.uslowmode_cache[guild.id] = {
+            int(channel_id): seconds
+            for channel_id, seconds in uslowmodes.items() if seconds
+        }
+        return cached
+
     async def _cases_info(self, ctx: commands.Context, user: discord.Member):
         """Get case summary of a member."""
-        
-        user_cases = await modlog.get_cases_for_member(
-            bot=self.bot, guild=ctx.guild, member=user
-        )
-        
+
+        index = await self.get_member_cases(ctx.guild, user)
+        user_cases = index.cases_of(user.id)
+
         if not user_cases:
             return False
 
         cases_info = {}
-        for case in user_cases:
-            try:
-                case_json = case.to_json()
-            except AttributeError:
-                continue
-            case_no = case_json["case_number"]
-            case_type = await modlog.get_casetype(case_json["action_type"])
-            case_name = case_type.case_str
-            # if "mute" in case_name.lower():
-            #     case_name = "Mute"
-            # case_type_name = modlog.get_casetype(case_type)
-            cases_info[case_no] = case_name
-            # await ctx.send(f"**Case Number:** {case_no}\n**Case Type:** {case_type.case_str}")
+        for case_no, action_type in user_cases.items():
+            cases_info[case_no] = await self.get_case_str(action_type)
         return cases_info
 
     async def _mute(self, ctx: commands.Context, user: discord.Member, dur: datetime = None):
@@ -1650,14 +1711,13 @@ class ExtMod(Mod, name='Mod'):
             return False, f"{user} is already muted."
 
         if dur:
-            queue_entry = (guild.id, user.id)
-
             timestamp = self.utc_timestamp(dur)
 
             await self.config.member(user).muted_until.set(timestamp)
-            cur_tmutes = await self.config.guild(guild).current_tempmutes()
-            cur_tmutes.append(user.id)
-            await self.config.guild(guild).current_tempmutes.set(cur_tmutes)
+            async with self.config.guild(guild).current_tempmutes() as cur_tmutes:
+                if user.id not in cur_tmutes:
+                    cur_tmutes.append(user.id)
+            self.tempmutes.schedule((guild.id, user.id), timestamp)
 
         mute_role = discord.utils.get(guild.roles, id=mute_role_id)
 
@@ -1667,62 +1727,81 @@ class ExtMod(Mod, name='Mod'):
 
         return True, False
 
-    async def check_tempmute_expirations(self):
-        Member = namedtuple("Member", "id guild")
-        while True:
-            for guild in self.bot.guilds:
-                async with self.config.guild(guild).current_tempmutes() as guild_tempmutes:
-                    for uid in guild_tempmutes.copy():
-                        try:
-                            unmute_time = datetime.utcfromtimestamp(
-                                await self.config.member(Member(uid, guild)).muted_until()
-                            )
-                        except TypeError:
-                            continue
-                        if not unmute_time:
-                            continue
-                        if datetime.utcnow() > unmute_time: # time to unmute the user
-                            user = await self.bot.fetch_user(uid)
-                            member = discord.utils.get(guild.members, id=uid)
-                            queue_entry = (guild.id, user.id)
-                            try:
-                                mute_role_id = await self.config.guild(guild).mute_role_id()
-                                mute_role = discord.utils.get(guild.roles, id=mute_role_id)
-                                await member.remove_roles(mute_role)
-                                async with self.config.member(member).sticky_roles() as sticky_roles:
-                                    sticky_roles.remove(mute_role_id)
-                                guild_tempmutes.remove(uid)
-                                await self.config.member(Member(uid, guild)).muted_until.set(None)
-                                await self.edit_tmute_msg(guild=guild, user=member)
-                                await self.create_temp_unmute_case(user, guild)
-
-                            except discord.HTTPException as e:
-                                # 50013: Missing permissions error code or 403: Forbidden status
-                                log.info(
-                                    f"Failed to unmute {user}({user.id})"
-                                    f" from {guild.name}({guild.id}) due to permissions."
-                                )
-            await asyncio.sleep(60)
+    async def load_tempmutes(self):
+        """Schedule the automatic unmute of every current temporary mute.
+
+        Mutes are read from config once, the scheduler keeps them in
+        memory afterwards.
+        """
+
+        await self.bot.wait_until_ready()
+
+        all_guilds = await self.config.all_guilds()
+        all_members = await self.config.all_members()
+        for guild_id, guild_data in all_guilds.items():
+            members = all_members.get(guild_id, {})
+            for uid in guild_data["current_tempmutes"]:
+                muted_until = members.get(uid, {}).get("muted_until")
+                if muted_until:
+                    self.tempmutes.schedule((guild_id, uid), muted_until)
+
+        self.tempmutes.start()
+
+    async def expire_tempmute(self, key: tuple):
+        """Unmute a temporarily muted member. Called by the scheduler."""
+
+        guild_id, uid = key
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+
+        mute_role_id = await self.config.guild(guild).mute_role_id()
+        member = guild.get_member(uid)
+        if member is None:
+            # left the server, don't give the mute role back on rejoin
+            async with self.config.member(Member(uid, guild)).sticky_roles() as sticky_roles:
+                sticky_roles[:] = [i for i in sticky_roles if i != mute_role_id]
+            await self._clear_tempmute(guild, uid)
+            return
+
+        try:
+            mute_role = discord.utils.get(guild.roles, id=mute_role_id)
+            await member.remove_roles(mute_role)
+        except discord.HTTPException:
+            # 50013: Missing permissions error code or 403: Forbidden status
+            log.info(
+                f"Failed to unmute {member}({member.id})"
+                f" from {guild.name}({guild.id}) due to permissions."
+            )
+            self.tempmutes.schedule(key, time.time() + UNMUTE_RETRY_DELAY)
+            return
+
+        async with self.config.member(member).sticky_roles() as sticky_roles:
+            sticky_roles[:] = [i for i in sticky_roles if i != mute_role_id]
+        await self._clear_tempmute(guild, uid)
+        await self.edit_tmute_msg(guild=guild, user=member)
+        await self.create_temp_unmute_case(member, guild)
+
+    async def _clear_tempmute(self, guild: discord.Guild, uid: int):
+        """Remove a temporary mute from config."""
+
+        async with self.config.guild(guild).current_tempmutes() as guild_tempmutes:
+            guild_tempmutes[:] = [i for i in guild_tempmutes if i != uid]
+        await self.config.member(Member(uid, guild)).muted_until.set(None)
 
     async def edit_tmute_msg(self, guild: discord.Guild, user: discord.Member):
         """Edit the temporary mute modlog message when unmuting."""
-        user_cases = await modlog.get_cases_for_member(guild=guild, bot=self.bot, member=user)
-        
-        case_no = 0
-        req_case = None
-        case_obj = None
-        for case in user_cases:
-            case_json = case.to_json()
-            if "tempmute" not in case_json["action_type"]:
-                continue
-            temp_cno = int(case_json["case_number"])
-            if temp_cno > case_no:
-                req_case = case_json
-                case_obj = case
-                continue
-        
-        if not req_case:
+
+        index = await self.get_member_cases(guild, user)
+        case_no = index.latest_of(user.id, "tempmute")
+        if case_no is None:
+            return
+
+        try:
+            case_obj = await modlog.get_case(case_no, guild, self.bot)
+        except RuntimeError:
             return
+        req_case = case_obj.to_json()
 
         start = datetime.fromtimestamp(req_case["created_at"])
         end = datetime.fromtimestamp(req_case["until"])
@@ -1739,31 +1818,59 @@ class ExtMod(Mod, name='Mod'):
 
         await case_obj.edit(data=data)
 
-    async def check_uslow_expirations(self):
-        Member = namedtuple("Member", "id guild")
-        while True:
-            for guild in self.bot.guilds:
-                async with self.config.guild(guild).uslowmodes() as guild_uslowmodes:
-                    for channel_id in guild_uslowmodes.copy():
-                        for user in guild.members:
-                            user_id = user.id
-                            async with self.config.member(Member(user_id, guild)).current_slowmodes() as slowmodes:
-                                try:
-                                    timestamp = slowmodes[channel_id]
-                                except:
-                                    continue
-                                if not timestamp:
-                                    continue
-                                duration = guild_uslowmodes[channel_id]
-                                if not duration:
-                                    continue
-                                dt_old = datetime.utcfromtimestamp(timestamp)
-                                delta = (datetime.utcnow() - dt_old).total_seconds()
-                                if delta >= duration:
-                                    channel = guild.get_channel(int(channel_id))
-                                    await channel.set_permissions(user, overwrite=None)
-                                    slowmodes[channel_id] = None
-            await asyncio.sleep(120)
+    async def load_uslow_locks(self):
+        """Schedule the end of every active custom slowmode lock.
+
+        Locks are read from config once, the scheduler keeps them in
+        memory afterwards.
+        """
+
+        await self.bot.wait_until_ready()
+
+        all_guilds = await self.config.all_guilds()
+        all_members = await self.config.all_members()
+        for guild_id, guild_data in all_guilds.items():
+            self.uslowmode_cache.setdefault(guild_id, {
+                int(channel_id): seconds
+                for channel_id, seconds in guild_data["uslowmodes"].items() if seconds
+            })
+
+        for guild_id, members in all_members.items():
+            uslowmodes = all_guilds.get(guild_id, {}).get("uslowmodes", {})
+            if not uslowmodes:
+                continue
+            for uid, member_data in members.items():
+                for channel_id, timestamp in member_data.get("current_slowmodes", {}).items():
+                    duration = uslowmodes.get(str(channel_id))
+                    if timestamp and duration:
+                        self.uslow_locks.schedule((int(channel_id), uid), timestamp + duration)
+
+        self.uslow_locks.start()
+
+    async def expire_uslow(self, key: tuple):
+        """Let a member talk in a custom slowmode channel again.
+
+        Called by the scheduler.
+        """
+
+        channel_id, uid = key
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return
+
+        guild = channel.guild
+        member = guild.get_member(uid)
+        if member is not None:
+            try:
+                await channel.set_permissions(member, overwrite=None)
+            except discord.HTTPException:
+                log.info(
+                    f"Failed to remove slowmode of {member}({member.id})"
+                    f" in {channel}({channel.id}) from {guild.name}({guild.id})."
+                )
+
+        async with self.config.member(Member(uid, guild)).current_slowmodes() as slowmodes:
+            slowmodes.pop(str(channel_id), None)
 
     def get_time(self, duration, ret_str=False):
         """Return time variables in appropriate format."""
@@ -1869,14 +1976,61 @@ class ExtMod(Mod, name='Mod'):
     async def get_case_number(self, guild: discord.Guild):
         """Get the current case number"""
 
-        latest_case = await get_latest_case(guild, self.bot)
-        if latest_case:
-            return latest_case.to_json()['case_number']
-        else:
-            return 0
+        index = await self.get_case_index(guild)
+        return index.latest
+
+    def index_case(self, case: Case):
+        """Add a new case to the index of its guild, if the index is loaded."""
+
+        index = self.case_index.get(case.guild.id)
+        if index is not None:
+            index.add(case.case_number, getattr(case.user, "id", case.user), case.action_type)
+
+    async def get_case_index(self, guild: discord.Guild) -> CaseIndex:
+        """Return case index of the guild, loading the latest case number."""
+
+        index = self.case_index.get(guild.id)
+        if index is None:
+            latest_case = await get_latest_case(guild, self.bot)
+            latest = latest_case.case_number if latest_case else 0
+            # another caller may have loaded it meanwhile
+            index = self.case_index.setdefault(guild.id, CaseIndex(latest))
+        return index
+
+    async def get_member_cases(self, guild: discord.Guild, member: discord.Member) -> CaseIndex:
+        """Return case index of the guild, with cases of the member loaded."""
+
+        index = await self.get_case_index(guild)
+        if not index.has_member(member.id):
+            user_cases = await modlog.get_cases_for_member(
+                bot=self.bot, guild=guild, member=member
+            )
+            index.load_member(
+                member.id, [(case.case_number, case.action_type) for case in user_cases]
+            )
+        return index
+
+    async def get_case_str(self, action_type: str) -> str:
+        """Return case string of a casetype, cached after the first lookup."""
+
+        try:
+            return self.casetype_names[action_type]
+        except KeyError:
+            pass
+
+        case_type = await modlog.get_casetype(action_type)
+        case_str = case_type.case_str if case_type else action_type
+        self.casetype_names[action_type] = case_str
+        return case_str
 
     def cog_unload(self):
+        self.mod_roles.invalidate()
+        self.uslowmode_cache.clear()
+        self.case_index.clear()
+        self.casetype_names.clear()
         self.tmute_expiry_task.cancel()
+        self.tempmutes.stop()
         self.uslow_expiry_task.cancel()
+        self.uslow_locks.stop()
 
     __unload = cog_unload
@@ -0,0 +1,72 @@
+import time
+
+import discord
+from redbot.core.bot import Red
+
+# core commands which change mod/admin roles of a guild
+ROLE_SETTING_COMMANDS = {
+    "set adminrole",
+    "set modrole",
+    "set addadminrole",
+    "set removeadminrole",
+    "set addmodrole",
+    "set removemodrole",
+}
+
+
+class ModRoleCache:
+    """Cache of mod and admin role ids of each guild.
+
+    A cheaper stand-in for `redbot.core.utils.mod.is_mod_or_superior`
+    on hot paths. Entries also expire after `ttl` seconds, in case
+    roles are changed in a way the cog isn't told about.
+
+    Same as the class of the same name in the AutoMod cog. Cogs are
+    installed separately, so neither can import the other.
+    """
+
+    def __init__(self, bot: Red, ttl: float = 300):
+        self.bot = bot
+        self.ttl = ttl
+        # guild id -> (expiry, frozenset of role ids)
+        self._roles = {}
+
+    async def is_mod_or_superior(self, user: discord.abc.User) -> bool:
+        """Return True if user is a bot owner, mod or admin."""
+
+        if await self.bot.is_owner(user):
+            return True
+
+        if not isinstance(user, discord.Member):
+            return False
+
+        roles = await self.get_role_ids(user.guild)
+        return bool(roles) and not roles.isdisjoint(
+            role.id for role in user.roles
+        )
+
+    async def get_role_ids(self, guild: discord.Guild) -> frozenset:
+        """Return ids of mod and admin roles of the guild."""
+
+        try:
+            expiry, roles = self._roles[guild.id]
+        except KeyError:
+            pass
+        else:
+            if expiry > time.monotonic():
+                return roles
+
+        admin_roles = await self.bot.get_admin_role_ids(guild.id)
+        mod_roles = await self.bot.get_mod_role_ids(guild.id)
+        roles = frozenset(admin_roles) | frozenset(mod_roles)
+
+        self._roles[guild.id] = (time.monotonic() + self.ttl, roles)
+        return roles
+
+    def invalidate(self, guild_id: int = None):
+        """Drop cached roles of the guild, or of all guilds."""
+
+        if guild_id is None:
+            self._roles.clear()
+        else:
+            self._roles.pop(guild_id, None)
@@ -0,0 +1,125 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+log = logging.getLogger("red.extmod.scheduler")
+
+
+class ExpiryScheduler:
+    """Call `callback(key)` when the expiry time of `key` is reached.
+
+    Expiries are UTC timestamps kept in a min-heap, and a single task
+    sleeps until the earliest one, so nothing runs while no key is due.
+    Rescheduling or cancelling a key leaves its old heap entry in place;
+    stale entries are skipped when they reach the top of the heap.
+    """
+
+    def __init__(self, callback: Callable[[Hashable], Awaitable]):
+        self.callback = callback
+
+        # (expiry, sequence, key), the sequence keeps keys from being compared
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        # key -> current expiry
+        self._expiry: Dict[Hashable, float] = {}
+        self._seq = itertools.count()
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # callbacks still running
+        self._running: Set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, key: Hashable):
+        return key in self._expiry
+
+    def when(self, key: Hashable) -> Optional[float]:
+        """Return the expiry of `key`, or None if it isn't scheduled."""
+
+        return self._expiry.get(key)
+
+    def schedule(self, key: Hashable, when: float):
+        """Call the callback for `key` at `when`, replacing its old expiry."""
+
+        if not self._heap or when < self._heap[0][0]:
+            self._wakeup.set()
+
+        self._expiry[key] = when
+        heapq.heappush(self._heap, (when, next(self._seq), key))
+
+        if len(self._heap) > 2 * len(self._expiry) + 64:
+            self._compact()
+
+    def cancel(self, key: Hashable) -> bool:
+        """Forget `key`. Return True if it was scheduled."""
+
+        return self._expiry.pop(key, None) is not None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        """Stop the scheduler and cancel running callbacks."""
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._running:
+            task.cancel()
+        self._running.clear()
+        self._heap.clear()
+        self._expiry.clear()
+
+    def _compact(self):
+        self._heap[:] = [
+            (when, next(self._seq), key) for key, when in self._expiry.items()
+        ]
+        heapq.heapify(self._heap)
+
+    async def _run(self):
+        heap = self._heap
+        while True:
+            self._wakeup.clear()
+
+            while heap and self._expiry.get(heap[0][2]) != heap[0][0]:
+                heapq.heappop(heap)
+
+            if not heap:
+                await self._sleep(None)
+                continue
+
+            when, _, key = heap[0]
+            delay = when - time.time()
+            if delay > 0:
+                await self._sleep(delay)
+                continue
+
+            heapq.heappop(heap)
+            del self._expiry[key]
+            self._fire(key)
+
+    async def _sleep(self, delay: Optional[float]):
+        """Sleep for `delay` seconds, or until an earlier key is scheduled."""
+
+        waiter = asyncio.ensure_future(self._wakeup.wait())
+        try:
+            await asyncio.wait((waiter,), timeout=delay)
+        finally:
+            waiter.cancel()
+
+    def _fire(self, key: Hashable):
+        task = asyncio.get_event_loop().create_task(self.callback(key))
+        self._running.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            log.error(
+                "Error in scheduled callback", exc_info=task.exception()
+            )